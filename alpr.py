@@ -2,7 +2,10 @@ import sys
 import os
 from threading import Thread
 from multiprocessing import Process, Queue, Event
+from queue import Full, Empty
 from pathlib import Path
+from functools import partial
+import time
 import cv2
 import torch
 import torch.backends.cudnn as cudnn
@@ -14,17 +17,19 @@ from utils.general import (
 from utils.plots import Annotator, colors, save_one_box
 from utils.torch_utils import select_device, time_sync
 from utils.logger import getLogger
-from tkinter import Tk, Label
-from PIL import Image, ImageTk
+from utils.tracker import PlateTracker, dhash
+from utils.preprocess import Preprocessor
+from utils.motion import MotionGate
+from utils.framebuffer import frame_buffer_name
 from firebase import TempDb
+from utils.dbwriter import get_writer
 from firebase_admin.db import Event as dbEvent
-from deepdiff import DeepDiff
-from datetime import datetime
-from utils.datetimefunc import datetime_now, seconds_from_now
+from utils.observable import ChangeSet, Tracked
+from utils.heartbeat import get_heartbeat
 import easyocr
-from operator import contains
-from constants.license_plate import LICENSE_NUMBER_CHARS
-from config import MODEL_NAME
+from ocr import OCRPool
+from config import MODEL_NAME, IMGSZ, ROIS, HEADLESS, PREVIEW_FPS, PREVIEW_SIZE, MOTION_GATE, MOTION_IDLE_SLEEP
+from preview import preview
 
 # > Initialize project path
 FILE = Path(__file__).resolve()
@@ -35,22 +40,24 @@ ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # Relative path
 
 
 def inference(
-    name: str,  # name
-    source: str,  # Path to the source. (Default: Webcam (0))
-    queue: Queue,  # Share memory between process and
+    nodes: list,  # Node names, one per source.
+    sources: list,  # Paths to the sources. (Default: Webcam (0))
+    queues: list,  # Share memory between process and each node.
     stop_event: Event,
+    preview_queues: list,  # Frames for each preview process. (None: headless)
+    wake_events: list,  # Set to run the detector at full rate, i.e. car sensor.
 ):
     # > Get logger and setting the logging level.
-    logger = getLogger(f'{name.title()}')
+    logger = getLogger('/'.join(node.title() for node in nodes))
     logger.propagate = False
     logger.info("YOLOv5 initializing.")
 
     # > Initialze YOLOv5 settings.
-    source = str(source)
+    sources = [str(source) for source in sources]
     # Detection model path.
     weights = ROOT / f'models/{MODEL_NAME}'
     data = ROOT / 'data/coco128.yaml'  # Dataset path.
-    imgsz = (640, 640)  # Inference size. (height, width)
+    imgsz = IMGSZ  # Inference size. (height, width)
     conf_thres = 0.25  # Confidence threshold.
     iou_thres = 0.45  # NMS IOU threshold.
     max_det = 1000  # Maximum detections per image.
@@ -65,36 +72,7 @@ def inference(
     # > Initialize EasyOCR reader.
     logger.info("EasyOCR initializing.")
     reader = easyocr.Reader(['th'])
-
-    # GUI settings
-    logger.info("Preview GUI initializing.")
-    gui = Tk()
-    gui.title(f'ALPR: {name.capitalize()} Preview')
-    gui.geometry("800x750+20+0" if name != 'exit' else "800x750+850+0")
-    gui.minsize("800", "750")
-    gui.maxsize("800", "750")
-    gui.rowconfigure(0, minsize="450")
-    gui.rowconfigure(2, minsize="225")
-
-    # Widgets
-
-    # video_feed
-    video_feed = Label(gui, text="(source video)")
-    video_feed.grid(row=0, column=0, columnspan=2)
-    video_feed_label = Label(gui, text="Video Feed")
-    video_feed_label.grid(row=1, column=0,  columnspan=3, pady=(5, 5))
-
-    # input_feed
-    input_feed = Label(gui, text="(wait for license plate detection)")
-    input_feed.grid(row=2, column=0)
-    input_feed_label = Label(gui, text="ALPR: Histogram Equalized")
-    input_feed_label.grid(row=3, column=0, pady=(5, 5))
-
-    # OCR feed.
-    ocr_feed = Label(gui, text="(wait for license plate detection)")
-    ocr_feed.grid(row=2, column=1)
-    ocr_feed_label = Label(gui, text="ALPR: OCR")
-    ocr_feed_label.grid(row=3, column=1, pady=(5, 5))
+    ocr_pool = OCRPool(reader)
 
     # Step 1: Loading model.
     device = select_device(device)
@@ -103,23 +81,58 @@ def inference(
     stride, names, pt = model.stride, model.names, model.pt
     imgsz = check_img_size(imgsz=imgsz, s=stride)
 
-    # Step 2: Loading source.
+    # Step 2: Loading sources. (one batch for all nodes)
     cudnn.benchmark = True  # set True to speed up constant image size inference
-    dataset = LoadStreams(source, img_size=imgsz, stride=stride, auto=pt)
+    dataset = LoadStreams(sources, img_size=imgsz, stride=stride, auto=pt,
+                          buffers=[frame_buffer_name(node) for node in nodes],
+                          rois=[ROIS.get(node) for node in nodes])
     bs = len(dataset)  # batch_size
+    # Fused letterbox + normalization into a reused input tensor.
+    preprocess = Preprocessor(imgsz, stride=stride, auto=pt and dataset.rect,
+                              device=device, half=model.fp16)
+    gates = [MotionGate() for _ in range(bs)]
+    active = list(range(bs))  # Streams the detector runs on this frame.
+
+    def is_woken(i):
+        if wake_events[i].is_set():
+            wake_events[i].clear()
+            return True
+        return False
+
+    def transforms(frames):
+        # Motion gate, then fused preprocessing when any lane has activity.
+        active[:] = [i for i, x in enumerate(frames)
+                     if not MOTION_GATE or gates[i].update(x, wake=is_woken(i))]
+        return preprocess(frames) if active else None
+    dataset.transforms = transforms
 
     # Step 3: Run inference.
     model.warmup(imgsz=(1 if pt else bs, 3, *imgsz))  # warm up
     seen, dt = 0, [0.0, 0.0, 0.0]
+    # Next time a frame is sent to each preview. (monotonic)
+    next_previews = [0] * bs
+    trackers = [PlateTracker() for _ in range(bs)]  # OCR cache per stream.
+    ocr_images = [None] * bs  # Latest OCR image per stream. (preview)
+
+    def on_ocr(i, track, crop_hash, license_number, imocr, timestamp):
+        # Called from OCR workers.
+        trackers[i].cache(track, license_number, crop_hash)
+        if license_number:
+            queues[i].put((license_number, timestamp))
+        if imocr is not None:
+            ocr_images[i] = imocr
+
     for path, im, im0s, vid_cap, s in dataset:
-        t1 = time_sync()
-        im = torch.from_numpy(im).to(device)
-        im = im.half() if model.fp16 else im.float()  # uint8 to fp16/32
-        im /= 255  # 0 - 255 to 0.0 - 1.0
-        if len(im.shape) == 3:
-            im = im[None]  # expand for batch dim
+        timestamp = time.time()  # Frame timestamp.
+        if im is None:  # every lane is static.
+            if stop_event.is_set():
+                break
+            time.sleep(MOTION_IDLE_SLEEP)
+            continue
+        if len(active) < bs:  # only the lanes with activity.
+            im = im[active]
         t2 = time_sync()
-        dt[0] += t2 - t1
+        dt[0] = preprocess.dt
 
         # Inference
         pred = model(im, augment=augment, visualize=False)
@@ -132,25 +145,30 @@ def inference(
         dt[2] += time_sync() - t3
 
         # Process predictions
-        for i, det in enumerate(pred):  # per image
+        for i, det in zip(active, pred):  # per image (node)
             seen += 1
 
             # Step 3.1: Setup predicted image and annotator.
-            p, im0, frame = path[i], im0s[i].copy(), dataset.count
+            p, im0, frame = path[i], im0s[i], dataset.count
+            queue, preview_queue = queues[i], preview_queues[i]
             s += '%gx%g ' % im.shape[2:]  # print string
+            is_preview = preview_queue is not None and time.monotonic() >= next_previews[i]
             annotator = Annotator(
-                im0, line_width=line_thickness, example=str(names))
-            imc = im0.copy()
+                im0.copy(), line_width=line_thickness, example=str(names)) if is_preview else None
 
             iminput, imocr = None, None
             license_number = ''
 
-            video_feed_label.configure(
-                text=f"No license plate detected.", background="red")
-            if len(det):
-                # Rescale boxes from img_size to im0 size
+            status = ("No license plate detected.", "red")
+            if not len(det):
+                trackers[i].update([])  # age out tracks.
+            else:
+                # Rescale boxes from img_size to region of interest, then to im0 size
+                x1, y1, x2, y2 = dataset.rois[i]
                 det[:, :4] = scale_boxes(
-                    im.shape[2:], det[:, :4], im0.shape).round()
+                    im.shape[2:], det[:, :4], (y2 - y1, x2 - x1), preprocess.ratio_pads[i]).round()
+                det[:, [0, 2]] += x1
+                det[:, [1, 3]] += y1
 
                 # Print results
                 for c in det[:, -1].unique():
@@ -159,112 +177,61 @@ def inference(
                     s += f"{n} {names[int(c)]}{'s' * (n > 1)}"
 
                 # Write results
-                # Step 3.2: Crop detected sections in images
-                imcs = []
-                for *xyxy, conf, cls in reversed(det):
+                # Step 3.2: Track plates and find biggest detection.
+                tracks = trackers[i].update(det[:, :5].tolist())
+                iminput, track, max_area = None, None, 0
+                for j, (*xyxy, conf, cls) in enumerate(det):
                     c = int(cls)  # integer class
                     label = None
-                    annotator.box_label(xyxy, label, color=colors(c, True))
-                    imcs.append(save_one_box(
-                        xyxy, imc, BGR=True, save=False))
-
-                # Step 3.3: Find biggest crop section.
-                iminput = None
-                maxArea = 0
-                for imc in imcs:
-                    area = imc.shape[0] * imc.shape[1]
-                    if area > maxArea:
-                        iminput = imc
-
-                # Step 3.4: Apply OCR.
+                    if annotator is not None:
+                        annotator.box_label(
+                            xyxy, label, color=colors(c, True))
+                    area = float((xyxy[2] - xyxy[0]) * (xyxy[3] - xyxy[1]))
+                    if area > max_area:
+                        max_area, track = area, tracks[j]
+                        iminput = save_one_box(
+                            xyxy, im0, BGR=True, save=False)
+
+                # Step 3.3: Queue OCR, unless the track's cached result is still valid.
                 iminput = cv2.equalizeHist(
                     cv2.cvtColor(iminput, cv2.COLOR_BGR2GRAY))
-                ocr_outputs = reader.readtext(
-                    iminput, add_margin=0.3, width_ths=0.9, allowlist="0123456789กขฃคฅฆงจฉชซฌญฎฏฐฑฒณดตถทธนบปผฝพฟภมยรลวศษสหฬอฮ")
-                imocr = iminput.copy()
-                texts = []
-                boxes = []
-                # filter out output with less than 60% confidence.
-                for (bbox, text, prob) in ocr_outputs:
-                    if prob > 0.1:
-                        texts.append(text)
-                        boxes.append({'bbox': bbox, 'chosen': False})
-                # Step 3.5: Check pattern license number pattern.
-                filtered_texts = []  # limit 2 texts
-                for i, text in enumerate(texts):  # ignore province.
-                    # if reach limit filtered texts. -> break loop.
-                    if len(filtered_texts) >= 2:
-                        break
-                    # if text more than 10 characters or less than 2 -> ignore text.
-                    elif len(text) > 10 or len(text) < 2:
-                        continue
-                    else:
-                        is_contain_number = False
-                        for char in text:  # check is text contain number.
-                            if char.isdigit():
-                                is_contain_number = True
-                                break
-                        # append when contain number or has 2 characters.
-                        if is_contain_number or len(text) <= 2:
-                            filtered_texts.append(text)
-                            boxes[i].update({'chosen': True})
-                for box in boxes:  # draw box on ocr image.
-                    (tl, tr, br, bl) = box.get('bbox', None)
-                    chosen = box.get('chosen', None)
-                    tl = (int(tl[0]), int(tl[1]))
-                    tr = (int(tr[0]), int(tr[1]))
-                    br = (int(br[0]), int(br[1]))
-                    bl = (int(bl[0]), int(bl[1]))
-                    cv2.rectangle(imocr, tl, br, (0, 255, 0)
-                                  if chosen else (0, 0, 255), 2)
-
-                filtered_text = ''
-                # re-order texts if has more than one text.
-                if len(filtered_texts) == 2:
-                    i_0_front = len(filtered_texts[0]) < 4
-                    filtered_text = f'{filtered_texts[0]}{filtered_texts[1]}' if i_0_front else f'{filtered_texts[1]}{filtered_texts[0]}'
-                if len(filtered_texts) == 1:  # assign to filtered_text.
-                    filtered_text = filtered_texts[0]
-                is_contain_digit = False
-                for char in filtered_text:  # check is filtered_text contains number.
-                    if char.isdigit():
-                        is_contain_digit = True
-                        break
-                if is_contain_digit:
-                    for char in filtered_text:
-                        if contains(LICENSE_NUMBER_CHARS, char):
-                            license_number += char
-
-                # Step 3.6: Update node values.
+                crop_hash = dhash(iminput)
+                if trackers[i].needs_ocr(track, crop_hash):
+                    ocr_pool.submit(partial(on_ocr, i, track, crop_hash),
+                                    iminput, timestamp, draw=is_preview)
+                    s += f' License ID queued. '
+                # The cached result stays in use while a re-OCR is in flight.
+                license_number = track.license_number or ''
+
+                # Step 3.4: Update node values from the cached result.
                 if len(license_number) > 0:
-                    queue.put(license_number)
-                    video_feed_label.configure(
-                        text=f"License plate detected. License number: {license_number}", background="green")
+                    queue.put((license_number, timestamp))
+                    status = (
+                        f"License plate detected. License number: {license_number}", "green")
                     s += f' License ID found. ({license_number}) '
+                elif track.pending:
+                    status = ("License plate detected. Reading license number.", "orange")
                 else:
-                    video_feed_label.configure(
-                        text=f"License plate detected. No license number detected.", background="orange")
+                    status = (
+                        "License plate detected. No license number detected.", "orange")
                     s += f' License ID not found. '
 
             # Stream results
-            im0 = annotator.result()
-            img_im0 = Image.fromarray(cv2.cvtColor(im0, cv2.COLOR_BGR2RGB)).resize(
-                (800, 450), Image.ANTIALIAS)
-            imgtk_im0 = ImageTk.PhotoImage(img_im0)
-            video_feed.configure(image=imgtk_im0)
-            if iminput is not None:
-                img_iminput = Image.fromarray(iminput).resize(
-                    (400, 225), Image.ANTIALIAS)
-                imgtk_iminput = ImageTk.PhotoImage(img_iminput)
-                input_feed.configure(image=imgtk_iminput)
-            if imocr is not None:
-                img_imcontour = Image.fromarray(imocr).resize(
-                    (400, 225), Image.ANTIALIAS)
-                imgtk_imcontour = ImageTk.PhotoImage(img_imcontour)
-                ocr_feed.configure(image=imgtk_imcontour)
-
-            gui.update_idletasks()
-            gui.update()
+            if is_preview:
+                next_previews[i] = time.monotonic() + 1 / PREVIEW_FPS
+                im0 = cv2.resize(annotator.result(), PREVIEW_SIZE,
+                                 interpolation=cv2.INTER_AREA)
+                if iminput is not None:
+                    iminput = cv2.resize(
+                        iminput, (PREVIEW_SIZE[0] // 2, PREVIEW_SIZE[1] // 2))
+                imocr, ocr_images[i] = ocr_images[i], None
+                if imocr is not None:
+                    imocr = cv2.resize(
+                        imocr, (PREVIEW_SIZE[0] // 2, PREVIEW_SIZE[1] // 2))
+                try:  # drop the frame when the preview is still busy.
+                    preview_queue.put_nowait((im0, iminput, imocr, *status))
+                except Full:
+                    pass
 
         # Print time (inference-only)
         # logger.info(f'{s} Done. ({t3 - t2:.3f}s)')
@@ -273,17 +240,87 @@ def inference(
         if stop_event.is_set():
             break
 
+    ocr_pool.stop()
+    dataset.close()
+    for node, x in zip(nodes, dataset.stats()):
+        logger.info(
+            f"{node.title()} stream: {x['decoded']} decoded, {x['retrieved']} retrieved, {x['consumed']} consumed, {x['dropped']} dropped frames. ({x['interval'] * 1E3:.1f}ms per consumed frame)")
+
     # Print results
     t = tuple(x / seen * 1E3 for x in dt)  # speeds per image
     logger.info(
         f'Speed: %.1fms pre-process, %.1fms inference, %.1fms NMS per image at shape {(1, 3, *imgsz)}' % t)
+    logger.info(
+        f'OCR: {sum(x.ocr_runs for x in trackers)} runs, {sum(x.ocr_hits for x in trackers)} cached results, {ocr_pool.dropped} dropped.')
+
+
+class InferenceService:
+    def __init__(
+        self,
+        nodes: list,  # [(node name, source path), ...]
+    ):
+        # > Local variables
+        self.nodes = [name for name, _ in nodes]
+        self._logger = getLogger('/'.join(name.title() for name in self.nodes))
+        self._sources = [str(source) for _, source in nodes]
+
+        # > Process
+        self._queues = {name: Queue() for name in self.nodes}
+        self._preview_queues = {
+            name: None if HEADLESS else Queue(maxsize=1) for name in self.nodes}
+        self._wake_events = {name: Event() for name in self.nodes}
+        self._stop_event = Event()
+        self._process = Process(
+            target=inference,
+            daemon=True,
+            args=(self.nodes, self._sources,
+                  [self._queues[name] for name in self.nodes], self._stop_event,
+                  [self._preview_queues[name] for name in self.nodes],
+                  [self._wake_events[name] for name in self.nodes])
+        )
+
+        self._logger.info(
+            f"Inference service initialized. (nodes: {', '.join(self.nodes)})")
+
+    def queue(self, name: str) -> Queue:
+        return self._queues[name]
+
+    def preview_queue(self, name: str) -> Queue:
+        return self._preview_queues[name]
+
+    def wake(self, name: str):
+        # Run the detector of a node at full rate.
+        self._wake_events[name].set()
+
+    # > Process functions
+    def start(self):
+        # Shared by several nodes, only the first call starts the process.
+        if self._process.is_alive():
+            return
+        self._logger.info("Inference service is starting.")
+        self._stop_event.clear()
+        self._process.start()
+
+    def stop(self):
+        if self._stop_event.is_set():
+            return
+        self._logger.info("Inference service is stopping.")
+        self._stop_event.set()
+        self._process.join()
+
+    def is_running(self):
+        return self._process.is_alive()
 
 
 class ALPR:
+    # License numbers counted since the last clear, assignments and mutations mark the status dirty.
+    license_numbers = Tracked('status/candidate_key', 'status/license_numbers')
+
     def __init__(
         self,
         name='node',  # node name.
         source: str = '0',  # source path. (Default: Webcam (0))
+        service: InferenceService = None,  # shared service. (Default: own process)
     ):
         # > Local variables
         self.name = name
@@ -294,29 +331,34 @@ class ALPR:
         self._source = str(source)
 
         # > ALPR variables
+        self._changes = ChangeSet()
         self.license_numbers = {}
-
-        # > Database
-        self._connected_timestamp = datetime.now()
-        self._status = {}
-        self._command = ''
-        self._db_ref = TempDb.reference(f"{self.name}/alpr")
-        self._db_ref.child("status").listen(self._db_status_callback)
-        self._db_ref.child("command").listen(self._db_command_callback)
+        self._cleared_timestamp = 0  # Frame timestamp of the last clear.
+        self._listeners = []
 
         # > Process and thread
-        self._queue = Queue()
+        self._service = service if service is not None else InferenceService(
+            [(self.name, self._source)])
+        self._queue = self._service.queue(self.name)
         self._stop_event = Event()
-        self._process = Process(
-            target=inference,
+        self._preview_process = None if HEADLESS else Process(
+            target=preview,
             daemon=True,
-            args=(self.name, self._source, self._queue, self._stop_event)
+            args=(self.name, self._service.preview_queue(
+                self.name), self._stop_event)
         )
         self._thread = Thread(
             target=self._update,
             daemon=True
         )
 
+        # > Database
+        self._command = ''
+        self._db_ref = TempDb.reference(f"{self.name}/alpr")
+        self._db_writer = get_writer().reference(f"{self.name}/alpr")
+        self._db_ref.child("status").listen(self._db_status_callback)
+        self._db_ref.child("command").listen(self._db_command_callback)
+
         self._logger.info(
             f"{self.name.title()} ALPR initialized. (source: {self._source})")
 
@@ -327,61 +369,87 @@ class ALPR:
             "license_numbers": self.keys()
         }
 
-    def _is_db_difference(self):
-        return len(DeepDiff(self._format_status_db(), self._status)) != 0
+    def _write_status(self):
+        # Write the changed status fields in one update.
+        update = self._changes.collect(status=self._format_status_db)
+        if len(update) != 0:
+            self._db_writer.update(update)
 
     def _db_status_callback(self, event: dbEvent):
-        self._status = event.data
+        # Rewrite fields edited from outside.
+        if self._changes.reconcile('status', event, self._format_status_db()):
+            self._queue.put(None)  # wake up the update thread.
 
     def _db_command_callback(self, event: dbEvent):
         self._command = event.data if event.data else ''
+        self._queue.put(None)  # wake up the update thread.
+
+    def add_listener(self, callback):
+        # Called after new license numbers are counted.
+        self._listeners.append(callback)
 
     # > Thread functions
     def start(self):
         self._logger.info(f"{self.name.title()} ALPR is starting.")
-        if self._process.is_alive():
-            return self._logger.warning("Process is already running.")
+        if self._thread.is_alive():
+            return self._logger.warning("Thread is already running.")
         self._stop_event.clear()
-        self._process.start()
+        self._service.start()
+        if self._preview_process is not None:
+            self._preview_process.start()
         self._thread.start()
 
     def stop(self):
         self._logger.info(f"{self.name.title()} ALPR is stopping.")
         self._stop_event.set()
-        self._process.join()
+        self._service.stop()
+        if self._preview_process is not None:
+            self._preview_process.join()
         self._thread.join()
 
     # > Thread logic functions
     def _update(self):
         # initialize value in the databse.
         self._logger.info("Initialize alpr's infos to Realtime Database.")
-        self._db_ref.child("status").set(self._format_status_db())
-        new_datetime, new_datetime_string = datetime_now()
-        self._connected_timestamp = new_datetime
-        self._db_ref.child("connected_timestamp").set(new_datetime_string)
-        self._db_ref.child("command").set(self._command)
-
-        while self._process.is_alive():  # while inference process is still running.
-            while not self._queue.empty():  # if queue has some data.
+        status = self._format_status_db()
+        self._db_writer.child("status").set(status)
+        self._changes.written('status', status)
+        get_heartbeat().register(f"{self.name}/alpr", self._thread.is_alive)
+        self._db_writer.child("command").set(self._command)
+
+        while self._service.is_running():  # while inference process is still running.
+            try:  # block until a result or a command arrives.
+                items = [self._queue.get(timeout=1)]
+                while not self._queue.empty():  # drain the rest.
+                    items.append(self._queue.get_nowait())
+            except Empty:
+                items = []
+            is_updated = False
+            for item in items:
+                if item is None:  # wake up only, i.e. command.
+                    continue
                 # update license_numbers.
-                license_number = self._queue.get()
+                license_number, timestamp = item
+                if timestamp < self._cleared_timestamp:
+                    continue  # late result from before the last clear.
                 old_license_number = self.license_numbers.get(license_number)
                 self.license_numbers.update(
                     {license_number: old_license_number + 1 if old_license_number else 1})
-            if self._is_db_difference():
-                self._db_ref.child("status").set(self._format_status_db())
-            if seconds_from_now(self._connected_timestamp, 5):
-                new_datetime, new_datetime_string = datetime_now()
-                self._connected_timestamp = new_datetime
-                self._db_ref.child("connected_timestamp").set(
-                    new_datetime_string)
+                is_updated = True
+            if is_updated:
+                for listener in self._listeners:
+                    listener()
+            if self._changes.is_dirty():
+                self._write_status()
             self._command_exec()
+        get_heartbeat().unregister(f"{self.name}/alpr")
         self._logger.info(f"{self.name.title()} ALPR has stopped.")
 
     def _command_exec(self):
         if self._command != '':
             self._logger.info(f'Received command: {self._command}')
             input = self._command.split(':')
+            self._command = ''  # run once, the cleared command echoing back from the database is a no-op.
             if hasattr(self, f'_c_{input[0]}'):
                 if len(input) == 2:
                     self._logger.info(
@@ -390,7 +458,7 @@ class ALPR:
                 elif len(input) == 1:
                     self._logger.info(f'Command Executed. [_c_{input[0]}()]')
                     getattr(self, f'_c_{input[0]}')()
-            self._db_ref.child('command').set('')
+            self._db_writer.child('command').set('', urgent=True)
 
     # > ALPR functions.
     def candidate_key(self):
@@ -407,13 +475,18 @@ class ALPR:
 
     def clear(self):
         self._logger.info("Clear ALPR.")
+        self._cleared_timestamp = time.time()
         self.license_numbers.clear()
+        self._queue.put(None)  # wake up the update thread to write the status.
+
+    def wake(self):
+        self._service.wake(self.name)
 
     def is_detect(self):
         return self.candidate_key() != ""
 
     def is_running(self):
-        return self._process.is_alive()
+        return self._service.is_running()
 
     def _c_clear(self):
         self.clear()
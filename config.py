@@ -2,6 +2,8 @@
 DVR_USERNAME = "admin"
 DVR_PASSWORD = "a1234567"
 DVR_IP_ADDR = "10.0.0.100"
+DVR_TIMEOUT = (2, 5)  # (connect, read) seconds per snapshot request.
+DVR_AUTH = 'digest'  # ISAPI authentication, 'digest' or 'basic'.
 
 # Global
 DEV = False
@@ -9,6 +11,19 @@ DEV = False
 # Transaction
 ENTRANCE_CHANNEL = 101
 EXIT_CHANNEL = 201
+FUZZY_MAX_DISTANCE = 0.7  # Maximum weighted edit distance of a fuzzy match, below 1 so only confusions match.
+UPLOAD_WORKERS = 2  # Image upload threads.
+UPLOAD_SPOOL = 'uploads'  # Journal of pending image uploads, kept across restarts.
+UPLOAD_MAX_ATTEMPTS = 8  # Attempts per image before giving up.
+UPLOAD_RETRY_DELAY = 5  # Seconds before retrying an image, doubled each attempt.
+SNAPSHOT_SOURCE = 'dvr'  # Gate pictures from 'dvr' snapshots or the latest 'alpr' stream frame.
+SNAPSHOT_MAX_AGE = 1.0  # Seconds an 'alpr' frame may be old, otherwise the DVR is used.
+STORE_PATH = 'transactions.db'  # Local SQLite mirror of the transactions and the offline outbox.
+OUTBOX_RETRY_DELAY = 5  # Seconds before resending the outbox, doubled up to a minute.
+OUTBOX_MAX_ATTEMPTS = 8  # Failed sends of a write, network errors aside, before it is moved to the failed table.
+WINDOW_DAYS = 28  # Days of transactions followed by the listener, open and unpaid ones are kept regardless.
+WINDOW_ROLL_INTERVAL = 24 * 60 * 60  # Seconds between rolling the window, each roll reads the window again.
+WINDOW_MAX_CLOSED = 20000  # Closed transactions cached, the oldest are evicted above it.
 
 
 def getRTSP(channel: int):
@@ -19,7 +34,51 @@ def getRTSP(channel: int):
 MODEL_NAME = "tha-license-plate-detection.pt"
 ENTRANCE_SOURCE = getRTSP(ENTRANCE_CHANNEL)
 EXIT_SOURCE = getRTSP(EXIT_CHANNEL)
+IMGSZ = (640, 640)  # Inference size. (height, width)
+DECODER = 'opencv'  # Stream decoder backend: 'opencv', 'pyav' or 'gstreamer'.
+DECODER_SCALE = None  # Decoded frame size (width, height). (None: source size)
+DECODER_KEYFRAME_ONLY = False  # Decode key frames only. (pyav, gstreamer)
+GSTREAMER_DECODER = 'decodebin'  # GStreamer decoder element, i.e. 'avdec_h264' or 'mppvideodec'.
+DECODER_RETRY_MAX = 30  # Maximum seconds between stream reconnects, doubled from 1 per failure.
+# Lane area of each camera, as (x1, y1, x2, y2) or a polygon [(x, y), ...] in decoded frame pixels.
+# Frames are cropped to it (a polygon's bounding box) before inference. (None: full frame)
+ROIS = {
+    'entrance': None,
+    'exit': None,
+}
+MOTION_GATE = True  # Skip detector frames while the lane is static.
+MOTION_WIDTH = 160  # Width of the downscaled motion image.
+MOTION_PIXEL_THRES = 25  # Gray level change of a moving pixel.
+MOTION_THRESHOLD = 0.01  # Fraction of moving pixels that wakes the detector.
+MOTION_HOLD = 10  # Seconds the detector stays at full rate after motion.
+MOTION_IDLE_INTERVAL = 2  # Seconds between detector frames while static.
+MOTION_IDLE_SLEEP = 0.2  # Seconds between motion checks while every lane is static.
+FRAME_BUFFER_SLOTS = 4  # Frames kept per stream in the shared ring buffer.
+SHARED_INFERENCE = True  # Run every gate through one model process.
+HEADLESS = False  # Run inference without the Tk preview window.
+PREVIEW_FPS = 5  # Maximum frames per second sent to the preview window.
+PREVIEW_SIZE = (800, 450)  # Preview video feed size. (width, height)
+TRACK_IOU = 0.3  # Minimum IoU to match a detection to a plate track.
+TRACK_MAX_AGE = 30  # Frames a plate track survives without detection.
+OCR_MOVE_IOU = 0.8  # Re-OCR when the box overlaps its last OCR'd box less than this.
+OCR_HASH_DISTANCE = 6  # Re-OCR when the crop hash differs by more bits than this.
+OCR_MIN_CONF = 0.5  # Always re-OCR detections below this confidence.
+OCR_RETRY_DELAY = 0.5  # Seconds before re-OCR of a plate whose last read failed.
+OCR_WORKERS = 2  # OCR worker threads.
+OCR_QUEUE_SIZE = 4  # Pending plate crops before the oldest is dropped.
+OCR_MAX_AGE = 2  # Seconds before a pending plate crop is stale.
+
+# State
+STATE_TICK = 0.5  # Maximum seconds between state evaluations without events.
+TIMER_TICK = 0.01  # Seconds per timer wheel slot.
+TIMER_SLOTS = 512  # Timer wheel slots, one revolution is TIMER_TICK * TIMER_SLOTS seconds.
+
+# Realtime Database
+DB_WRITE_INTERVAL = 0.1  # Seconds between batched writes.
+HEARTBEAT_INTERVAL = 5  # Seconds between connected_timestamp writes.
+HEARTBEAT_JITTER = 0.5  # Random +/- seconds on each heartbeat interval.
 
 # Controller
 HOVER_CMS = 5
 CAR_CMS = 150
+CONTROLLER_READ_TIMEOUT = 0.05  # Seconds a serial read blocks, bounds the delay of queued commands.
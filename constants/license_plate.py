@@ -5,3 +5,18 @@ LICENSE_NUMBER_CHARS = (
     'ฟ', 'ภ', 'ม', 'ย', 'ร', 'ฤ', 'ล', 'ฦ', 'ว', 'ศ',
     'ษ', 'ส', 'ห', 'ฬ', 'อ', 'ฮ', '1', '2', '3', '4',
     '5', '6', '7', '8', '9', '0')
+
+# Substitution cost of visually similar characters on plates, others cost 1.
+LICENSE_NUMBER_CONFUSIONS = {
+    ('ก', 'ถ'): 0.5, ('ก', 'ภ'): 0.5, ('ถ', 'ภ'): 0.5,
+    ('ข', 'ช'): 0.5, ('ข', 'ซ'): 0.6, ('ช', 'ซ'): 0.5, ('ข', 'ฆ'): 0.6,
+    ('ค', 'ด'): 0.5, ('ค', 'ต'): 0.6, ('ด', 'ต'): 0.5, ('ค', 'ศ'): 0.6, ('ค', 'ฅ'): 0.5,
+    ('ด', 'ฎ'): 0.5, ('ต', 'ฏ'): 0.5, ('ฎ', 'ฏ'): 0.5,
+    ('ท', 'ฑ'): 0.5, ('ท', 'ห'): 0.6, ('ม', 'ฆ'): 0.6, ('น', 'ม'): 0.7,
+    ('บ', 'ป'): 0.5, ('บ', 'ษ'): 0.6, ('ป', 'ฝ'): 0.6,
+    ('ผ', 'ฝ'): 0.5, ('พ', 'ฟ'): 0.5, ('ผ', 'พ'): 0.5, ('ฝ', 'ฟ'): 0.5,
+    ('ร', 'ธ'): 0.6, ('ล', 'ส'): 0.6, ('ศ', 'ส'): 0.5, ('ศ', 'ษ'): 0.6,
+    ('อ', 'ฮ'): 0.5, ('ญ', 'ฌ'): 0.5, ('ณ', 'ฌ'): 0.6, ('ย', 'ษ'): 0.7,
+    ('0', '8'): 0.5, ('3', '8'): 0.5, ('6', '8'): 0.5, ('5', '6'): 0.6,
+    ('1', '7'): 0.5, ('0', '9'): 0.7, ('2', '7'): 0.7,
+}
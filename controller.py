@@ -3,15 +3,25 @@ import time
 from serial import Serial
 from utils.logger import getLogger
 from firebase import TempDb
+from utils.dbwriter import get_writer
 from firebase_admin.db import Event as dbEvent
-from deepdiff import DeepDiff
-from datetime import datetime
-from utils.datetimefunc import datetime_now, seconds_from_now
-from config import HOVER_CMS, CAR_CMS
+from utils.observable import ChangeSet, Tracked
+from utils.heartbeat import get_heartbeat
+from config import HOVER_CMS, CAR_CMS, CONTROLLER_READ_TIMEOUT
 import argparse
 
 
 class ControllerClient:
+    # > Database fields, assignments mark them for the next database write.
+    _hover_cms = Tracked('config/hover_cms', 'status/k_hover')
+    _car_cms = Tracked('config/car_cms', 'status/p_has_car')
+    mode = Tracked('status/mode')
+    b_open = Tracked('status/b_open')
+    b_close = Tracked('status/b_close')
+    k_sensor = Tracked('status/k_hover')
+    k_button = Tracked('status/k_button')
+    p_sensor = Tracked('status/p_has_car')
+    p_barricade = Tracked('status/p_barricade')
 
     def __init__(
         self,
@@ -24,6 +34,7 @@ class ControllerClient:
         # > Local variables
         self.name = name
         self._logger = getLogger(name.title())
+        self._changes = ChangeSet()
 
         # > Arduino configuration
         if port is not None:
@@ -42,11 +53,9 @@ class ControllerClient:
         self.p_barricade = False
 
         # > Database
-        self._connected_timestamp = datetime.now()
-        self._status = {}
-        self._config = {}
         self._command = ''
         self._db_ref = TempDb.reference(f'{self.name}/controller')
+        self._db_writer = get_writer().reference(f'{self.name}/controller')
         # listen on status.
         self._db_ref.child('status').listen(self._db_status_callback)
         # listen on config.
@@ -81,17 +90,19 @@ class ControllerClient:
         "car_cms": self._car_cms
     }
 
-    def _is_status_difference(self):
-        return len(DeepDiff(self._format_db_status(), self._status)) != 0
-
-    def _is_config_difference(self):
-        return len(DeepDiff(self._format_db_config(), self._config)) != 0
+    def _write_changes(self):
+        # Write the changed status and config fields in one update.
+        update = self._changes.collect(
+            status=self._format_db_status, config=self._format_db_config)
+        if len(update) != 0:
+            self._db_writer.update(update)
 
+    # Rewrite fields edited from outside.
     def _db_status_callback(self, event: dbEvent):
-        self._status = event.data
+        self._changes.reconcile('status', event, self._format_db_status())
 
     def _db_config_callback(self, event: dbEvent):
-        self._config = event.data
+        self._changes.reconcile('config', event, self._format_db_config())
 
     def _db_command_callback(self, event: dbEvent):
         self._command = event.data if event.data else ''
@@ -115,29 +126,38 @@ class ControllerClient:
         self._logger.info(
             f"{self.name.title()} Controller Client has started.")
         self._logger.info("Open serial communication.")
+        self._arduino.timeout = CONTROLLER_READ_TIMEOUT  # readline returns early, queued commands run in between.
+        self._line = b''  # Partial line read before the timeout.
         self._arduino.open()  # open serial communication.
         time.sleep(5)  # wait for serial communication to open.
 
         # initialize value in the database.
-        self._db_ref.child('status').set(self._format_db_status())
-        self._db_ref.child('config').set(self._format_db_config())
-        self._db_ref.child('command').set(self._command)
-        new_datetime, new_datetime_string = datetime_now()
-        self._connected_timestamp = new_datetime
-        self._db_ref.child("connected_timestamp").set(new_datetime_string)
+        status, config = self._format_db_status(), self._format_db_config()
+        self._db_writer.child('status').set(status)
+        self._db_writer.child('config').set(config)
+        self._changes.written('status', status)
+        self._changes.written('config', config)
+        self._db_writer.child('command').set(self._command)
+        get_heartbeat().register(f'{self.name}/controller', self._thread.is_alive)
         self._logger.info(
             "Initialize controller's infos to Realtime Database.")
 
         while not self._stop_event.is_set():
-            while self._arduino.in_waiting:
-                self._update()
-                self._command_exec()
+            self._update()  # blocks until a line arrives or the read timeout.
+            self._command_exec()
+        get_heartbeat().unregister(f'{self.name}/controller')
         self._logger.info(
             f"{self.name.title()} Controller Client has stopped.")
 
     def _update(self):
         try:
-            data = self._arduino.readline().decode('ascii')
+            self._line += self._arduino.readline()
+            if not self._line.endswith(b'\n'):
+                if len(self._line) > 1024:  # no line ending, drop the noise.
+                    self._line = b''
+                return  # rest of the line on the next read.
+            line, self._line = self._line, b''
+            data = line.decode('ascii')
             input = data.strip('\n\r').split(':')
             if(input[0] != "Values"):
                 return  # skipping if not values.
@@ -157,23 +177,16 @@ class ControllerClient:
         except:
             self._logger.warning('Some error occured.')
 
-        if self._is_status_difference():
-            self._logger.debug("Update status's infos to Realtime Database.")
-            self._db_ref.child('status').set(self._format_db_status())
-
-        if self._is_config_difference():
-            self._logger.debug("Update config's infos to Realtime Database.")
-            self._db_ref.child('config').set(self._format_db_config())
+        if self._changes.is_dirty():
+            self._logger.debug("Update controller's infos to Realtime Database.")
+            self._write_changes()
 
-        if seconds_from_now(self._connected_timestamp, 5):
-            new_datetime, new_datetime_string = datetime_now()
-            self._connected_timestamp = new_datetime
-            self._db_ref.child("connected_timestamp").set(new_datetime_string)
 
     def _command_exec(self):
         if self._command != '':
             self._logger.info(f'Received command: {self._command}')
             input = self._command.split(':')
+            self._command = ''  # run once, the cleared command echoing back from the database is a no-op.
             if hasattr(self, f'_c_{input[0]}'):
                 if len(input) == 2:
                     self._logger.info(
@@ -182,7 +195,7 @@ class ControllerClient:
                 elif len(input) == 1:
                     self._logger.info(f'Command Executed. [_c_{input[0]}()]')
                     getattr(self, f'_c_{input[0]}')()
-            self._db_ref.child('command').set('')
+            self._db_writer.child('command').set('', urgent=True)
 
     # > Command functions
     def _c_set_hover_cms(self, input: str):
@@ -229,7 +242,9 @@ class ControllerServer:
 
         # > Database
         self._command = None
+        self._listeners = []
         self._db_ref = TempDb.reference(f'{self.name}/controller')
+        self._db_writer = get_writer().reference(f'{self.name}/controller')
         # listen on status.
         self._db_ref.child('status').listen(self._db_status_callback)
         # listen on config.
@@ -250,6 +265,12 @@ class ControllerServer:
             self.k_button = event.data.get('k_button', False)
             self.p_has_car = event.data.get('p_has_car', False)
             self.p_barricade = event.data.get('p_barricade', False)
+            for listener in self._listeners:
+                listener()
+
+    def add_listener(self, callback):
+        # Called after every status update.
+        self._listeners.append(callback)
 
     def _db_config_callback(self, event: dbEvent):
         if type(event.data) is dict:
@@ -261,19 +282,19 @@ class ControllerServer:
 
     # > Command functions
     def set_hover_cms(self, cms: int):
-        self._db_ref.child('command').set(f'set_hover_cms:{cms}')
+        self._db_writer.child('command').set(f'set_hover_cms:{cms}', urgent=True)
         self._logger.info(f"Set hover cms: {cms}")
 
     def set_car_cms(self, cms: int):
-        self._db_ref.child('command').set(f'set_car_cms:{cms}')
+        self._db_writer.child('command').set(f'set_car_cms:{cms}', urgent=True)
         self._logger.info(f"Set car cms: {cms}")
 
     def open_barricade(self):
-        self._db_ref.child('command').set(f'open_barricade')
+        self._db_writer.child('command').set(f'open_barricade', urgent=True)
         self._logger.info(f"Open barricade.")
 
     def close_barricade(self):
-        self._db_ref.child('command').set(f'close_barricade')
+        self._db_writer.child('command').set(f'close_barricade', urgent=True)
         self._logger.info(f"Close barricade.")
 
 
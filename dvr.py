@@ -0,0 +1,109 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth, HTTPDigestAuth
+from utils.logger import getLogger
+from config import DVR_IP_ADDR, DVR_USERNAME, DVR_PASSWORD, DVR_TIMEOUT, DVR_AUTH
+
+
+class DvrClient:
+    # Hikvision ISAPI client for channel snapshots.
+    # One session keeps connections alive and reuses the digest nonce between requests.
+    def __init__(
+        self,
+        url: str = f'http://{DVR_IP_ADDR}',  # DVR base url, or a local stub server.
+        username: str = DVR_USERNAME,
+        password: str = DVR_PASSWORD,
+        timeout: tuple = DVR_TIMEOUT,  # (connect, read) seconds per request.
+        auth: str = DVR_AUTH,  # 'digest' or 'basic'.
+        pool_size: int = 4,  # Connections kept alive, also the number of concurrent fetches.
+    ):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self._logger = getLogger('DVR')
+        self._session = requests.Session()
+        self._session.auth = HTTPDigestAuth(username, password) if auth == 'digest' \
+            else HTTPBasicAuth(username, password)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=1)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='dvr')
+        self._lock = Lock()
+        self._stats = {}  # channel -> {'requests', 'errors', 'last', 'total', 'max'} in seconds.
+
+    def snapshot(self, channel: int) -> bytes:
+        # JPEG picture of a channel.
+        t = time.perf_counter()
+        try:
+            response = self._session.get(
+                f'{self.url}/ISAPI/Streaming/channels/{channel}/picture', timeout=self.timeout)
+            response.raise_for_status()
+            image = response.content
+        except Exception:
+            self._record(channel, None)
+            raise
+        self._record(channel, time.perf_counter() - t)
+        return image
+
+    def snapshots(self, channels: list) -> dict:
+        # Fetch channels concurrently, returns {channel: bytes or the raised exception}.
+        futures = {channel: self._executor.submit(self.snapshot, channel) for channel in channels}
+        return {channel: future.exception() or future.result() for channel, future in futures.items()}
+
+    def submit(self, channel: int):
+        # Fetch a channel in the background, returns a Future of the picture.
+        return self._executor.submit(self.snapshot, channel)
+
+    def _record(self, channel: int, latency: float):
+        with self._lock:
+            stats = self._stats.setdefault(
+                channel, {'requests': 0, 'errors': 0, 'last': 0.0, 'total': 0.0, 'max': 0.0})
+            stats['requests'] += 1
+            if latency is None:
+                stats['errors'] += 1
+                return
+            stats['last'] = latency
+            stats['total'] += latency
+            stats['max'] = max(stats['max'], latency)
+
+    def stats(self):
+        # Latency in milliseconds per channel.
+        with self._lock:
+            return {channel: {
+                'requests': s['requests'],
+                'errors': s['errors'],
+                'last_ms': s['last'] * 1E3,
+                'avg_ms': s['total'] / max(s['requests'] - s['errors'], 1) * 1E3,
+                'max_ms': s['max'] * 1E3,
+            } for channel, s in self._stats.items()}
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self._session.close()
+
+
+def main():
+    # Fetch snapshots and report latency, i.e. against a stub server: python dvr.py --url http://127.0.0.1:8000
+    import argparse
+    from config import ENTRANCE_CHANNEL, EXIT_CHANNEL
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', type=str, default=f'http://{DVR_IP_ADDR}', help='DVR base url.')
+    parser.add_argument('--channels', type=int, nargs='+', default=[ENTRANCE_CHANNEL, EXIT_CHANNEL])
+    parser.add_argument('--runs', type=int, default=10, help='number of concurrent fetches.')
+    opt = parser.parse_args()
+
+    dvr = DvrClient(opt.url)
+    for _ in range(opt.runs):
+        for channel, image in dvr.snapshots(opt.channels).items():
+            if isinstance(image, Exception):
+                print(f'{channel}: {image}')
+    for channel, stats in dvr.stats().items():
+        print(f'{channel}: {stats}')
+    dvr.close()
+
+
+if __name__ == '__main__':
+    main()
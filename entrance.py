@@ -1,5 +1,4 @@
-from time import sleep
-from state import State
+from state import State, on_enter, on_state, on_command
 from transaction import Transaction
 from line import callStaff
 from config import ENTRANCE_SOURCE
@@ -7,12 +6,14 @@ from config import ENTRANCE_SOURCE
 
 class EntranceState(State):
 
-    def __init__(self, dev=False):
+    def __init__(self, dev=False, service=None):
         super().__init__('entrance', init_state='idle',
-                         source="1" if dev else ENTRANCE_SOURCE)
+                         source="1" if dev else ENTRANCE_SOURCE, service=service)
+        Transaction.add_listener(self.notify)
         self.alpr.start()
 
     # [S0]: Idle
+    @on_enter('idle')
     def _init_idle(self):  # > Entry
         # Clear keys on ALPR.
         self.alpr.clear()
@@ -21,6 +22,7 @@ class EntranceState(State):
         # Clear state info.
         self.info.clear()
 
+    @on_state('idle', to=('detect',))
     def _idle(self):  # > Logic
         # > Next state
         # 1.ALPR detected -> [S1:Detect]
@@ -28,10 +30,12 @@ class EntranceState(State):
             self.next_state = "detect"
             return
 
+    @on_command('set_idle', to=('idle',))
     def _c_set_idle(self):  # > Command
         self.next_state = "idle"
 
     # [S1]: Detect.
+    @on_state('detect', to=('process', 'idle'))
     def _detect(self):  # > Logic
         # > Next state
         # 1.Hand hovered on Controller -> [S2:Process]
@@ -40,7 +44,7 @@ class EntranceState(State):
             self.next_state = "process"
             return
         # 2.No action after 30 seconds -> [S0:Idle]
-        if self.seconds_from_now(30):
+        if self.is_timeout(30):
             self.next_state = "idle"
             return
         # 3.Cancel detection -> [S0:Idle]
@@ -49,6 +53,7 @@ class EntranceState(State):
             return
 
     # [S2]: Process.
+    @on_enter('process', to=('success', 'failed'))
     def _init_process(self):  # > Entry
         # Get license number.
         license_number = self.info.get("license_number", None)
@@ -76,38 +81,39 @@ class EntranceState(State):
             self.next_state = "failed"
             return
 
+    @on_command('set_process', to=('process',))
     def _c_set_process(self, input: str):  # > Command
         if input is str:
             self.info = {"license_number": input}
             self.next_state = "process"
 
     # [S3]: Success.
+    @on_enter('success')
     def _init_success(self):  # > Entry
         # Open barricade.
         self.controller.open_barricade()
         # Create is_car_pass.
         self.info.update({"is_car_pass": False})
 
+    @on_state('success', to=('cooldown',))
     def _success(self):  # > Logic
         # Update is_car_pass when detected car at first time.
         if self.controller.p_has_car is True and self.info.get("is_car_pass") is False:
             self.info.update({"is_car_pass": True})
 
         # > Next state
-        # 1. Car has pass and not detected car.
-        if self.info.get("is_car_pass") is True and self.controller.p_has_car is False and self.seconds_from_now(5):
-            self.next_state = "idle"
+        # 1. Car has pass and not detected car. -> [S5:Cooldown]
+        if self.info.get("is_car_pass") is True and self.controller.p_has_car is False and self.is_timeout(5):
+            self.next_state = "cooldown"
             return
 
-    def _end_success(self):  # > End
-        # wait 5 more seconds.
-        sleep(5)
-
     # [S4]: Failed.
+    @on_enter('failed')
     def _init_failed(self):
         # Initialize call staff.
         self.info.update({"call_staff": False})
 
+    @on_state('failed', to=('idle',))
     def _failed(self):  # > Logic
         tid = self.info.get("tid", None)
         transaction = Transaction.get(tid)
@@ -123,11 +129,20 @@ class EntranceState(State):
             self.next_state = "idle"
             return
         # 2.After 15 seconds and not have previous issue -> [S0:Idle]
-        if self.seconds_from_now(15) and tid is None:
+        if self.is_timeout(15) and tid is None:
             self.next_state = "idle"
             return
         # 3.After issue solve or timeout 120 seconds  -> [S0:Idle]
-        if transaction.is_paid() is True or self.seconds_from_now(120):
+        if transaction.is_paid() is True or self.is_timeout(120):
+            self.next_state = "idle"
+            return
+
+    # [S5]: Cooldown.
+    @on_state('cooldown', to=('idle',))
+    def _cooldown(self):  # > Logic
+        # > Next state
+        # 1.After 5 seconds -> [S0:Idle]
+        if self.is_timeout(5):
             self.next_state = "idle"
             return
 
@@ -1,5 +1,4 @@
-from time import sleep
-from state import State
+from state import State, on_enter, on_state, on_command
 from transaction import Transaction
 from line import callStaff
 from config import EXIT_SOURCE
@@ -7,12 +6,14 @@ from config import EXIT_SOURCE
 
 class ExitState(State):
 
-    def __init__(self, dev=False):
+    def __init__(self, dev=False, service=None):
         super().__init__('exit', init_state='idle',
-                         source="0" if dev else EXIT_SOURCE)
+                         source="0" if dev else EXIT_SOURCE, service=service)
+        Transaction.add_listener(self.notify)
         self.alpr.start()
 
     # [S0]: Idle
+    @on_enter('idle')
     def _init_idle(self):  # > Entry
         # Clear keys on ALPR.
         self.alpr.clear()
@@ -21,6 +22,7 @@ class ExitState(State):
         # Clear state info.
         self.info.clear()
 
+    @on_state('idle', to=('detect',))
     def _idle(self):  # > Logic
         # > Next state
         # 1.ALPR detected -> [S1:Detect]
@@ -28,18 +30,22 @@ class ExitState(State):
             self.next_state = "detect"
             return
 
+    @on_command('set_idle', to=('idle',))
     def _c_set_idle(self):  # > Command
         self.next_state = "idle"
 
     # [S1]: Detect
+    @on_enter('detect')
     def _init_detect(self):  # > Entry
         # Create checked_license_numbers.
         self.info.update({"checked_license_numbers": list()})
 
+    @on_state('detect', to=('get', 'idle', 'failed'))
     def _detect(self):  # > Logic
         # Check for license_number in transaction.
         f_tid = None
         f_license_number = None
+        new_license_numbers = []
         for license_number in self.alpr.keys():
             # Continue if already checked.
             if license_number in self.info.get("checked_license_numbers"):
@@ -52,7 +58,12 @@ class ExitState(State):
                 f_license_number = license_number
                 break
             else:  # Append to checked_license_numbers if not found.
-                self.info["checked_license_numbers"].append(license_number)
+                self.info["checked_license_numbers"] = [
+                    *self.info["checked_license_numbers"], license_number]
+                new_license_numbers.append(license_number)
+        # Fall back to similar license numbers, OCR may misread a character.
+        if f_tid is None and len(new_license_numbers) != 0:
+            f_tid, f_license_number = self._find_similar(new_license_numbers)
 
         # > Next state
         # 1.Found tid -> [S2:Get]
@@ -65,12 +76,27 @@ class ExitState(State):
             self.next_state = "idle"
             return
         # 3.If not found all afer (30 seconds) -> [S5:Failed]
-        if len(self.alpr.keys()) == len(self.info.get("checked_license_numbers", [])) and self.seconds_from_now(30):
+        if len(self.alpr.keys()) == len(self.info.get("checked_license_numbers", [])) and self.is_timeout(30):
             self.info = {"reason": "Not found license_number in the system."}
             self.next_state = "failed"
             return
 
+    def _find_similar(self, license_numbers: list):
+        # Nearest open transaction of the license numbers, only if it is unambiguous.
+        matches = sorted(match for license_number in license_numbers
+                         for match in Transaction.find_license_number(license_number))
+        if len(matches) == 0:
+            return None, None
+        distance, license_number, tid = matches[0]
+        if any(m[0] == distance and m[2] != tid for m in matches[1:]):
+            self._logger.info(f"Ambiguous similar license numbers: {matches}")
+            return None, None
+        self._logger.info(
+            f"Similar license number: {license_number} (distance: {distance}) | TID: {tid}")
+        return tid, license_number
+
     # [S2]: Get transaction
+    @on_enter('get', to=('failed', 'success', 'payment'))
     def _init_get(self):  # > Entry
         # Get transaction
         transaction = Transaction.get(self.info.get("tid"))
@@ -95,6 +121,7 @@ class ExitState(State):
             self.next_state = "payment"
             return
 
+    @on_command('set_get', to=('get',))
     def _c_set_get(self, input: str):  # > Command
         args = input.split(",")
         if len(args) == 2:
@@ -102,6 +129,7 @@ class ExitState(State):
             self.next_state = "get"
 
     # [S3]: Success
+    @on_enter('success', to=('failed',))
     def _init_success(self):  # > Entry
         # Get transaction
         transaction = Transaction.get(self.info.get("tid"))
@@ -116,26 +144,25 @@ class ExitState(State):
         # Create is_car_pass.
         self.info.update({"is_car_pass": False})
 
+    @on_state('success', to=('cooldown',))
     def _success(self):  # > Logic
       # Update is_car_pass when detected car at first time.
         if self.controller.p_has_car is True and self.info.get("is_car_pass") is False:
             self.info.update({"is_car_pass": True})
 
         # > Next state
-        # 1. Car has pass and not detected car.
-        if self.info.get("is_car_pass") is True and self.controller.p_has_car is False and self.seconds_from_now(5):
-            self.next_state = "idle"
+        # 1. Car has pass and not detected car. -> [S6:Cooldown]
+        if self.info.get("is_car_pass") is True and self.controller.p_has_car is False and self.is_timeout(5):
+            self.next_state = "cooldown"
             return
 
-    def _end_success(self):  # > End
-        # wait 5 more seconds.
-        sleep(5)
-
     # [S4]: Payment
+    @on_enter('payment')
     def _init_payment(self):  # > Init
         # Initialize call staff.
         self.info.update({"call_staff": False})
 
+    @on_state('payment', to=('failed', 'success', 'idle'))
     def _payment(self):  # > Logic
         # Get transaction
         transaction = Transaction.get(self.info.get("tid"))
@@ -161,7 +188,7 @@ class ExitState(State):
             self.next_state = "success"
             return
         # 4.Transaction unpaid after 120 seconds -> [S4: Failed]
-        if self.seconds_from_now(120):
+        if self.is_timeout(120):
             self.info = {"reason": "Payment timeout."}
             self.next_state = "failed"
             return
@@ -171,10 +198,12 @@ class ExitState(State):
             return
 
     # [S5]: Failed.
+    @on_enter('failed')
     def _init_failed(self):  # > Init
         # Initialize call staff.
         self.info.update({"call_staff": False})
 
+    @on_state('failed', to=('idle',))
     def _failed(self):  # > Logic
         # Hover to call staff.
         if self.controller.k_hover is True and self.info.get("call_staff") is False:
@@ -183,7 +212,7 @@ class ExitState(State):
 
         # > Next state
         # 1.After 15 seconds and not have previous issue -> [S0:Idle]
-        if self.seconds_from_now(15):
+        if self.is_timeout(15):
             self.next_state = "idle"
             return
         # 2.Button pressed on Controller -> [S0:Idle]
@@ -191,6 +220,15 @@ class ExitState(State):
             self.next_state = "idle"
             return
 
+    # [S6]: Cooldown.
+    @on_state('cooldown', to=('idle',))
+    def _cooldown(self):  # > Logic
+        # > Next state
+        # 1.After 5 seconds -> [S0:Idle]
+        if self.is_timeout(5):
+            self.next_state = "idle"
+            return
+
 
 def main():
     exit = ExitState(dev=True)
@@ -1,3 +1,4 @@
+from tempfile import NamedTemporaryFile
 from linenotipy import Line
 from transaction import Transaction
 from utils.logger import getLogger
@@ -10,10 +11,12 @@ logger = getLogger("LINENotify")
 def callStaff(type: str):
     try:
         datetime, datetime_string = datetime_now()
-        Transaction.get_image(type)
-        image = "in.jpg" if type == "in" else "out.jpg"
-        line.post(
-            message=f'\nCALL STAFF AT\n[{"ENTRANCE" if type == "in" else "EXIT"}]\n({datetime_string})', imageFile=image)
+        image = Transaction.get_image(type)
+        with NamedTemporaryFile(suffix='.jpg') as f:  # LINE Notify uploads from a file.
+            f.write(image)
+            f.flush()
+            line.post(
+                message=f'\nCALL STAFF AT\n[{"ENTRANCE" if type == "in" else "EXIT"}]\n({datetime_string})', imageFile=f.name)
         logger.info("Notification sent.")
     except Exception:
         logger.error(
@@ -1,16 +1,22 @@
 from entrance import EntranceState
 from exit import ExitState
-from config import DEV
+from alpr import InferenceService
+from config import DEV, SHARED_INFERENCE, ENTRANCE_SOURCE, EXIT_SOURCE
 
 def main():
     try:
-        entrance = EntranceState(dev=DEV)
+        # One model process serves both gates in a single batch.
+        service = InferenceService([
+            ('entrance', "1" if DEV else ENTRANCE_SOURCE),
+            ('exit', "0" if DEV else EXIT_SOURCE),
+        ]) if SHARED_INFERENCE else None
+        entrance = EntranceState(dev=DEV, service=service)
         entrance.start()
-        exit = ExitState(dev=DEV)
+        exit = ExitState(dev=DEV, service=service)
         exit.start()
         while entrance.is_running() and exit.is_running():
-            pass
-    except Exception:
+            entrance.wait(1)
+    except (Exception, KeyboardInterrupt):
         entrance.stop()
         exit.stop()
 
@@ -0,0 +1,137 @@
+import time
+from threading import Thread
+from queue import Queue, Full, Empty
+from operator import contains
+import cv2
+import easyocr
+from constants.license_plate import LICENSE_NUMBER_CHARS
+from config import OCR_WORKERS, OCR_QUEUE_SIZE, OCR_MAX_AGE
+
+
+def read_license_number(
+    reader: easyocr.Reader,  # EasyOCR reader.
+    iminput,  # Histogram equalized license plate crop.
+    draw: bool = False,  # Draw OCR boxes on a copy of the input.
+):
+    ocr_outputs = reader.readtext(
+        iminput, add_margin=0.3, width_ths=0.9, allowlist="0123456789กขฃคฅฆงจฉชซฌญฎฏฐฑฒณดตถทธนบปผฝพฟภมยรลวศษสหฬอฮ")
+    imocr = iminput.copy() if draw else None
+    texts = []
+    boxes = []
+    # filter out output with less than 60% confidence.
+    for (bbox, text, prob) in ocr_outputs:
+        if prob > 0.1:
+            texts.append(text)
+            boxes.append({'bbox': bbox, 'chosen': False})
+    # Check pattern license number pattern.
+    filtered_texts = []  # limit 2 texts
+    for i, text in enumerate(texts):  # ignore province.
+        # if reach limit filtered texts. -> break loop.
+        if len(filtered_texts) >= 2:
+            break
+        # if text more than 10 characters or less than 2 -> ignore text.
+        elif len(text) > 10 or len(text) < 2:
+            continue
+        else:
+            is_contain_number = False
+            for char in text:  # check is text contain number.
+                if char.isdigit():
+                    is_contain_number = True
+                    break
+            # append when contain number or has 2 characters.
+            if is_contain_number or len(text) <= 2:
+                filtered_texts.append(text)
+                boxes[i].update({'chosen': True})
+    for box in boxes if draw else []:  # draw box on ocr image.
+        (tl, tr, br, bl) = box.get('bbox', None)
+        chosen = box.get('chosen', None)
+        tl = (int(tl[0]), int(tl[1]))
+        br = (int(br[0]), int(br[1]))
+        cv2.rectangle(imocr, tl, br, (0, 255, 0)
+                      if chosen else (0, 0, 255), 2)
+
+    filtered_text = ''
+    # re-order texts if has more than one text.
+    if len(filtered_texts) == 2:
+        i_0_front = len(filtered_texts[0]) < 4
+        filtered_text = f'{filtered_texts[0]}{filtered_texts[1]}' if i_0_front else f'{filtered_texts[1]}{filtered_texts[0]}'
+    if len(filtered_texts) == 1:  # assign to filtered_text.
+        filtered_text = filtered_texts[0]
+    license_number = ''
+    is_contain_digit = False
+    for char in filtered_text:  # check is filtered_text contains number.
+        if char.isdigit():
+            is_contain_digit = True
+            break
+    if is_contain_digit:
+        for char in filtered_text:
+            if contains(LICENSE_NUMBER_CHARS, char):
+                license_number += char
+    return license_number, imocr
+
+
+class OCRPool:
+    # Bounded pool of OCR threads fed with plate crops by the detection loop.
+    def __init__(
+        self,
+        reader: easyocr.Reader,  # EasyOCR reader, shared by the workers.
+        workers: int = OCR_WORKERS,  # Number of worker threads.
+        size: int = OCR_QUEUE_SIZE,  # Maximum pending crops.
+        max_age: float = OCR_MAX_AGE,  # Seconds before a pending crop is stale.
+    ):
+        self._reader = reader
+        self._max_age = max_age
+        self._jobs = Queue(maxsize=size)
+        self._threads = [Thread(target=self._work, daemon=True)
+                         for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+        # > Statistics
+        self.processed = 0
+        self.dropped = 0
+
+    def submit(
+        self,
+        callback,  # callback(license_number, imocr, timestamp), license_number is None when dropped.
+        iminput,  # Histogram equalized license plate crop.
+        timestamp: float,  # Frame timestamp.
+        draw: bool = False,  # Draw OCR boxes for the preview.
+    ):
+        job = (callback, iminput, timestamp, draw)
+        try:
+            self._jobs.put_nowait(job)
+        except Full:  # saturated, drop the oldest crop.
+            try:
+                self._drop(self._jobs.get_nowait())
+            except Empty:
+                pass
+            try:
+                self._jobs.put_nowait(job)
+            except Full:
+                self._drop(job)
+
+    def stop(self):
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _drop(self, job):
+        callback, _, timestamp, _ = job
+        self.dropped += 1
+        callback(None, None, timestamp)
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            callback, iminput, timestamp, draw = job
+            if time.time() - timestamp > self._max_age:
+                self._drop(job)
+                continue
+            license_number, imocr = read_license_number(
+                self._reader, iminput, draw=draw)
+            self.processed += 1
+            callback(license_number, imocr, timestamp)
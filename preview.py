@@ -0,0 +1,76 @@
+from multiprocessing import Queue, Event
+from queue import Empty
+from utils.logger import getLogger
+from config import PREVIEW_FPS
+
+
+def preview(
+    name: str,  # name
+    frames: Queue,  # Latest frames published by the inference process.
+    stop_event: Event,
+    fps: float = PREVIEW_FPS,  # Maximum refresh rate.
+):
+    # > GUI modules are imported here, so only the preview process loads tkinter.
+    from tkinter import Tk, Label
+    from PIL import Image, ImageTk
+    import cv2
+
+    # > Get logger and setting the logging level.
+    logger = getLogger(f'{name.title()}')
+    logger.propagate = False
+
+    # GUI settings
+    logger.info("Preview GUI initializing.")
+    gui = Tk()
+    gui.title(f'ALPR: {name.capitalize()} Preview')
+    gui.geometry("800x750+20+0" if name != 'exit' else "800x750+850+0")
+    gui.minsize("800", "750")
+    gui.maxsize("800", "750")
+    gui.rowconfigure(0, minsize="450")
+    gui.rowconfigure(2, minsize="225")
+
+    # Widgets
+
+    # video_feed
+    video_feed = Label(gui, text="(source video)")
+    video_feed.grid(row=0, column=0, columnspan=2)
+    video_feed_label = Label(gui, text="Video Feed")
+    video_feed_label.grid(row=1, column=0,  columnspan=3, pady=(5, 5))
+
+    # input_feed
+    input_feed = Label(gui, text="(wait for license plate detection)")
+    input_feed.grid(row=2, column=0)
+    input_feed_label = Label(gui, text="ALPR: Histogram Equalized")
+    input_feed_label.grid(row=3, column=0, pady=(5, 5))
+
+    # OCR feed.
+    ocr_feed = Label(gui, text="(wait for license plate detection)")
+    ocr_feed.grid(row=2, column=1)
+    ocr_feed_label = Label(gui, text="ALPR: OCR")
+    ocr_feed_label.grid(row=3, column=1, pady=(5, 5))
+
+    def show(widget: Label, image):
+        imgtk = ImageTk.PhotoImage(Image.fromarray(image))
+        widget.configure(image=imgtk)
+        widget.image = imgtk  # keep a reference, Tk does not.
+
+    interval = 1 / fps
+    while not stop_event.is_set():
+        try:
+            im0, iminput, imocr, text, color = frames.get(timeout=interval)
+        except Empty:  # no new frame, keep the window responsive.
+            gui.update()
+            continue
+
+        # Stream results
+        video_feed_label.configure(text=text, background=color)
+        show(video_feed, cv2.cvtColor(im0, cv2.COLOR_BGR2RGB))
+        if iminput is not None:
+            show(input_feed, iminput)
+        if imocr is not None:
+            show(ocr_feed, imocr)
+
+        gui.update_idletasks()
+        gui.update()
+
+    gui.destroy()
@@ -1,37 +1,146 @@
+import time
 from datetime import datetime
 from threading import Thread, Event
-from utils.datetimefunc import datetime_now, seconds_from_now
+from utils.heartbeat import get_heartbeat
+from utils.timerwheel import TimerWheel
 from utils.logger import getLogger
 from firebase import TempDb
+from utils.dbwriter import get_writer
 from firebase_admin.db import Event as dbEvent
-from deepdiff import DeepDiff
+from utils.observable import ChangeSet, Tracked
 from controller import ControllerServer
-from alpr import ALPR
+from alpr import ALPR, InferenceService
+from config import STATE_TICK
+
+
+# > Handler decorators
+# Registered once per class in State.__init_subclass__, `to` lists the states a handler may move to.
+def on_enter(state: str, to: tuple = ()):
+    return _hook('enter', state, to)
+
+
+def on_state(state: str, to: tuple = ()):
+    return _hook('state', state, to)
+
+
+def on_exit(state: str, to: tuple = ()):
+    return _hook('exit', state, to)
+
+
+def on_command(command: str, to: tuple = ()):
+    return _hook('command', command, to)
+
+
+def _hook(kind: str, name: str, to: tuple):
+    def decorator(func):
+        func._state_hook = (kind, name, (to,) if isinstance(to, str) else tuple(to))
+        return func
+    return decorator
 
 
 class State(object):
+    # Dispatch tables, compiled per subclass.
+    _hooks = {'enter': {}, 'state': {}, 'exit': {}, 'command': {}}
+    _transitions = {}  # (kind, name) -> target states.
+
+    # > Status fields, assignments mark them for the next database write.
+    current_state = Tracked('status/current_state')
+    prev_state = Tracked('status/prev_state')
+    next_state = Tracked('status/next_state')
+    enter_timestamp = Tracked('status/enter_timestamp')
+    info = Tracked('status/info')  # Replace nested values instead of mutating them.
 
-    def __init__(self, name: str, source='0', init_state: str = 'init'):
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        hooks = {kind: {} for kind in State._hooks}
+        transitions = {}
+        for klass in reversed(cls.__mro__):
+            for func in vars(klass).values():
+                if hasattr(func, '_state_hook'):
+                    kind, name, to = func._state_hook
+                    hooks[kind][name] = func
+                    transitions[(kind, name)] = to
+        cls._hooks = hooks
+        cls._transitions = transitions
+        states = cls.states()
+        for (kind, name), targets in transitions.items():
+            for target in targets:
+                if target not in states:
+                    raise ValueError(f'{cls.__name__}: {kind} handler "{name}" moves to unknown state "{target}".')
+
+    # > State machine description
+    @classmethod
+    def states(cls):
+        return {name for kind in ('enter', 'state', 'exit') for name in cls._hooks[kind]}
+
+    @classmethod
+    def validate(cls, init_state: str = 'idle'):
+        # Returns the problems of the machine, i.e. states unreachable from init_state.
+        problems = []
+        states = cls.states()
+        if init_state not in states:
+            return [f'Initial state "{init_state}" has no handler.']
+        commands = {t for (kind, _), targets in cls._transitions.items() if kind == 'command' for t in targets}
+        reached, stack = set(), [init_state, *commands]
+        while stack:
+            state = stack.pop()
+            if state in reached:
+                continue
+            reached.add(state)
+            for kind in ('enter', 'state', 'exit'):
+                stack.extend(cls._transitions.get((kind, state), ()))
+        for state in sorted(states - reached):
+            problems.append(f'State "{state}" is unreachable.')
+        for state in sorted(states):
+            if not any(cls._transitions.get((kind, state)) for kind in ('enter', 'state', 'exit')):
+                problems.append(f'State "{state}" has no way out.')
+        return problems
+
+    @classmethod
+    def to_dot(cls, init_state: str = 'idle'):
+        # Graphviz description of the machine, commands can be sent from any state.
+        lines = [f'digraph {cls.__name__} {{', '    rankdir=LR;',
+                 f'    "{init_state}" [shape=doublecircle];']
+        for state in sorted(cls.states() - {init_state}):
+            lines.append(f'    "{state}" [shape=circle];')
+        lines.append('    "*" [shape=point];')
+        for (kind, name), targets in sorted(cls._transitions.items()):
+            for target in targets:
+                if kind == 'command':
+                    lines.append(f'    "*" -> "{target}" [label="{name}", style=dotted];')
+                else:
+                    style = '' if kind == 'state' else f' [label="{kind}", style=dashed]'
+                    lines.append(f'    "{name}" -> "{target}"{style};')
+        lines.append('}')
+        return '\n'.join(lines)
+
+    def __init__(self, name: str, source='0', init_state: str = 'init', service: InferenceService = None):
         # > Local variables
         self.name = name
         self._logger = getLogger(f'{self.name.capitalize()}')
+        self._changes = ChangeSet()
         self.current_state = init_state
         self.prev_state = ''
         self.next_state = ''
         self.enter_timestamp = datetime.now()
         self.info = {}
+        self._wakeup = Event()  # Set by anything the state logic may react to.
+        self._timers = TimerWheel()
+        self._state_timers = {}  # Timeout seconds -> Timer of the current state.
+        self._enter_monotonic = time.monotonic()
 
         # > Controller
         self.controller = ControllerServer(self.name)
 
         # # > ALPR
-        self.alpr = ALPR(self.name, source)
+        self.alpr = ALPR(self.name, source, service)
+        self.controller.add_listener(self._controller_callback)
+        self.alpr.add_listener(self.notify)
 
         # > Database
-        self._connected_timestamp = datetime.now()
-        self._status = {}
         self._command = ''
         self._db_ref = TempDb.reference(f'{self.name}/state')
+        self._db_writer = get_writer().reference(f'{self.name}/state')
         self._db_ref.child("status").listen(self._db_status_callback)
         self._db_ref.child("command").listen(self._db_command_callback)
 
@@ -39,6 +148,8 @@ class State(object):
         self._thread = Thread(target=self._process, daemon=True)
         self._stop_event = Event()
 
+        for problem in self.validate(init_state):
+            self._logger.warning(problem)
         self._logger.info(f'{self.name.capitalize()} State initialized.')
 
     # > Database functions
@@ -53,18 +164,45 @@ class State(object):
             format.update({'info': self.info})
         return format
 
-    def _is_status_difference(self):
-        return len(DeepDiff(self._format_status_db(), self._status)) != 0
+    def _write_status(self):
+        # Write the changed status fields in one update.
+        update = self._changes.collect(status=self._format_status_db)
+        if len(update) != 0:
+            self._db_writer.update(update)
 
     def _db_status_callback(self, event: dbEvent):
-        self._status = event.data
+        # Rewrite fields edited from outside.
+        if self._changes.reconcile('status', event, self._format_status_db()):
+            self.notify()
+
+    def _controller_callback(self):
+        # Car sensor wakes the detector before the camera sees motion.
+        if self.controller.p_has_car:
+            self.alpr.wake()
+        self.notify()
 
     def _db_command_callback(self, event: dbEvent):
         self._command = event.data if event.data else ''
+        self.notify()
 
     # > State utilities
-    def seconds_from_now(self, seconds: int):
-        return seconds_from_now(self.enter_timestamp, seconds)
+    def notify(self):
+        # Wake the state thread to evaluate the current state.
+        self._wakeup.set()
+
+    def is_timeout(self, seconds: float):
+        # Whether seconds have passed since entering the current state.
+        # The first call in a state registers the deadline, which wakes the state thread when it expires.
+        timer = self._state_timers.get(seconds)
+        if timer is None:
+            timer = self._timers.schedule_at(self._enter_monotonic + seconds, self.notify)
+            self._state_timers[seconds] = timer
+        return timer.fired
+
+    def _clear_state_timers(self):
+        for timer in self._state_timers.values():
+            timer.cancel()
+        self._state_timers.clear()
 
     # > State functions
     def start(self):
@@ -78,69 +216,87 @@ class State(object):
         self._logger.info(f'{self.name.capitalize()} State is stopping.')
         self.alpr.stop()
         self._stop_event.set()
+        self.notify()
         self._thread.join()
 
     def is_running(self):
-        self._thread.is_alive()
+        return self._thread.is_alive()
+
+    def wait(self, timeout: float = None):
+        # Block until the state thread stops or timeout.
+        self._thread.join(timeout)
+
     # > State logic functions
 
     def _process(self):
         self._logger.info(f'{self.name.capitalize()} State has started.')
         self._logger.info(f"Initialize state's infos to Realtime Database.")
         # initialize value in the database.
-        self._db_ref.child("status").set(self._format_status_db())
-        new_datetime, new_datetime_string = datetime_now()
-        self._connected_timestamp = new_datetime
-        self._db_ref.child("connected_timestamp").set(new_datetime_string)
-        self._db_ref.child("command").set(self._command)
+        status = self._format_status_db()
+        self._db_writer.child("status").set(status)
+        self._changes.written('status', status)
+        get_heartbeat().register(f'{self.name}/state', self._thread.is_alive)
+        self._db_writer.child("command").set(self._command)
 
-        while not self._stop_event.isSet():
+        while not self._stop_event.is_set():
+            # Sleep until an event or the next deadline, STATE_TICK bounds the delay of polled conditions.
+            self._wakeup.wait(self._timers.next_timeout(STATE_TICK))
+            self._wakeup.clear()
+            self._timers.advance()
             self._update_state()
             self._process_state()
             self._command_exec()
+            if self.next_state == self.current_state:  # already there, nothing to apply.
+                self.next_state = ''
+            elif self.next_state != '':  # apply the transition right away.
+                self.notify()
+        get_heartbeat().unregister(f'{self.name}/state')
         self._logger.info(f'{self.name.capitalize()} State has stopped.')
 
     def _update_state(self):
-        if self.next_state != '' and self.next_state != self.current_state:
+        if self.next_state == self.current_state:
+            self.next_state = ''
+        if self.next_state != '':
             self._logger.info(
                 f'Detect new state. ([{self.current_state}] -> [{self.next_state}])')
-            init_method = "_init_" + self.next_state
-            end_method = "_end_" + self.current_state
-            if hasattr(self, end_method):
-                self._logger.info(f"Execute end method. [{end_method}]")
-                getattr(self, end_method)()
+            end_method = self._hooks['exit'].get(self.current_state)
+            init_method = self._hooks['enter'].get(self.next_state)
+            if end_method is not None:
+                self._logger.info(f"Execute end method. [{end_method.__name__}]")
+                end_method(self)
             self.prev_state = self.current_state
             self.current_state = self.next_state
             self.next_state = ''
             self.enter_timestamp = datetime.now()
-            self._db_ref.child("status").set(self._format_status_db())
+            self._enter_monotonic = time.monotonic()
+            self._clear_state_timers()
+            self._write_status()
             self._logger.info("Update state's info.")
-            if hasattr(self, init_method):
-                self._logger.info(f"Execute init method. [{init_method}]")
-                getattr(self, init_method)()
+            if init_method is not None:
+                self._logger.info(f"Execute init method. [{init_method.__name__}]")
+                init_method(self)
 
-        if self._is_status_difference():
-            self._db_ref.child("status").set(self._format_status_db())
+        if self._changes.is_dirty():
+            self._write_status()
 
-        if seconds_from_now(self._connected_timestamp, 5):
-            new_datetime, new_datetime_string = datetime_now()
-            self._connected_timestamp = new_datetime
-            self._db_ref.child("connected_timestamp").set(new_datetime_string)
 
     def _process_state(self):
-        if hasattr(self, "_" + self.current_state):
-            getattr(self, "_" + self.current_state)()
+        handler = self._hooks['state'].get(self.current_state)
+        if handler is not None:
+            handler(self)
 
     def _command_exec(self):
         if self._command != '':
             self._logger.info(f'Received command: {self._command}')
             input = self._command.split(':')
-            if hasattr(self, f'_c_{input[0]}'):
+            self._command = ''  # run once, the cleared command echoing back from the database is a no-op.
+            handler = self._hooks['command'].get(input[0])
+            if handler is not None:
                 if len(input) == 2:
                     self._logger.info(
-                        f'Command Executed. [_c_{input[0]}({input[1]})]')
-                    getattr(self, f'_c_{input[0]}')(input[1])
+                        f'Command Executed. [{handler.__name__}({input[1]})]')
+                    handler(self, input[1])
                 elif len(input) == 1:
-                    self._logger.info(f'Command Executed. [_c_{input[0]}()]')
-                    getattr(self, f'_c_{input[0]}')()
-            self._db_ref.child('command').set('')
+                    self._logger.info(f'Command Executed. [{handler.__name__}()]')
+                    handler(self)
+            self._db_writer.child('command').set('', urgent=True)
@@ -0,0 +1,177 @@
+import json
+import sqlite3
+import time
+from datetime import datetime
+from threading import Event, Lock, Thread
+from utils.logger import getLogger
+from config import STORE_PATH, OUTBOX_RETRY_DELAY, OUTBOX_MAX_ATTEMPTS
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    return str(value)  # i.e. document references, only kept for display.
+
+
+def _decode(value: dict):
+    if '__datetime__' in value:
+        return datetime.fromisoformat(value['__datetime__'])
+    return value
+
+
+def dumps(data: dict):
+    return json.dumps(data, default=_encode, ensure_ascii=False)
+
+
+def loads(text: str):
+    return json.loads(text, object_hook=_decode)
+
+
+class TransactionStore:
+    # Local mirror of the transactions collection in SQLite (WAL), with an outbox of pending writes.
+    # The mirror serves the cache at boot, the outbox lets the gates work without network.
+    def __init__(
+        self,
+        path: str = STORE_PATH,  # Database file.
+        retry_delay: float = OUTBOX_RETRY_DELAY,  # Seconds before resending the outbox, doubled up to a minute.
+        max_attempts: int = OUTBOX_MAX_ATTEMPTS,  # Failed sends of a write before it is moved to the failed table.
+    ):
+        self.path = path
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self._logger = getLogger('Store')
+        self._lock = Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS transactions (tid TEXT PRIMARY KEY, data TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, op TEXT NOT NULL, tid TEXT NOT NULL,
+                data TEXT NOT NULL, created REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0);
+            CREATE TABLE IF NOT EXISTS failed (
+                id INTEGER PRIMARY KEY, op TEXT NOT NULL, tid TEXT NOT NULL, data TEXT NOT NULL,
+                created REAL NOT NULL, attempts INTEGER NOT NULL, error TEXT);
+        ''')
+        self._wakeup = Event()
+        self._thread = None
+        self.sent = 0
+        self.errors = 0
+        self.failed = 0
+
+    # > Mirror functions
+    def load(self):
+        # Return [(tid, data)] of the mirrored transactions.
+        with self._lock:
+            rows = self._db.execute('SELECT tid, data FROM transactions').fetchall()
+        return [(tid, loads(data)) for tid, data in rows]
+
+    def apply(self, changes: list, read_time: datetime = None):
+        # changes: [(kind, tid, data)] with kind "ADDED", "MODIFIED" or "REMOVED", in one transaction.
+        with self._lock:
+            self._db.execute('BEGIN')
+            try:
+                for kind, tid, data in changes:
+                    if kind == 'REMOVED':
+                        self._db.execute('DELETE FROM transactions WHERE tid = ?', (tid,))
+                        continue
+                    row = self._db.execute('SELECT data FROM transactions WHERE tid = ?', (tid,)).fetchone()
+                    if kind == 'MODIFIED' and row is not None:
+                        data = {**loads(row[0]), **data}
+                    self._db.execute('INSERT OR REPLACE INTO transactions (tid, data) VALUES (?, ?)',
+                                     (tid, dumps(data)))
+                if read_time is not None:
+                    self._db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                                     ('read_time', read_time.isoformat()))
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+
+    def read_time(self):
+        # Read time of the last mirrored snapshot. (None: never synced)
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'read_time'").fetchone()
+        return datetime.fromisoformat(row[0]) if row else None
+
+    # > Outbox functions
+    def enqueue(self, op: str, tid: str, data: dict):
+        # Queue a write, op: "set" or "update" of the transaction document.
+        with self._lock:
+            self._db.execute('INSERT INTO outbox (op, tid, data, created) VALUES (?, ?, ?, ?)',
+                             (op, tid, dumps(data), time.time()))
+        self._wakeup.set()
+
+    def pending_tids(self):
+        with self._lock:
+            return {tid for tid, in self._db.execute('SELECT DISTINCT tid FROM outbox')}
+
+    def overlay(self, tid: str, data: dict):
+        # data with the pending writes of tid on top, in order.
+        with self._lock:
+            rows = self._db.execute('SELECT data FROM outbox WHERE tid = ? ORDER BY id', (tid,)).fetchall()
+        for row in rows:
+            data = {**data, **loads(row[0])}
+        return data
+
+    def pending(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+
+    def stats(self):
+        return {'pending': self.pending(), 'sent': self.sent, 'errors': self.errors, 'failed': self.failed}
+
+    def start_sync(self, send, transient: tuple = (), permanent: tuple = ()):
+        # Send the outbox in order with send(op, tid, data) on a background thread.
+        # transient errors (network) retry forever, permanent errors fail the write at once,
+        # other errors fail it after max_attempts, so it does not block the writes behind it.
+        if self._thread is None:
+            self._thread = Thread(target=self._sync, args=(send, transient, permanent), daemon=True)
+            self._thread.start()
+            self._wakeup.set()  # writes left from the last run.
+
+    def _fail(self, row_id: int, error: Exception):
+        # Move a write to the failed table, kept for manual replay.
+        with self._lock:
+            self._db.execute('BEGIN')
+            self._db.execute('INSERT INTO failed (id, op, tid, data, created, attempts, error) '
+                             'SELECT id, op, tid, data, created, attempts, ? FROM outbox WHERE id = ?',
+                             (repr(error), row_id))
+            self._db.execute('DELETE FROM outbox WHERE id = ?', (row_id,))
+            self._db.execute('COMMIT')
+        self.failed += 1
+
+    def _sync(self, send, transient: tuple, permanent: tuple):
+        failures = 0
+        while True:
+            self._wakeup.wait(min(self.retry_delay * 2 ** (failures - 1), 60) if failures else None)
+            self._wakeup.clear()
+            while True:
+                with self._lock:
+                    row = self._db.execute(
+                        'SELECT id, op, tid, data FROM outbox ORDER BY id LIMIT 1').fetchone()
+                if row is None:
+                    break
+                row_id, op, tid, data = row
+                try:
+                    send(op, tid, loads(data))
+                except Exception as e:
+                    self.errors += 1
+                    if not isinstance(e, transient):
+                        with self._lock:
+                            self._db.execute('UPDATE outbox SET attempts = attempts + 1 WHERE id = ?', (row_id,))
+                            attempts = self._db.execute(
+                                'SELECT attempts FROM outbox WHERE id = ?', (row_id,)).fetchone()[0]
+                        if isinstance(e, permanent) or attempts >= self.max_attempts:
+                            self._fail(row_id, e)
+                            self._logger.error(f'Give up {op} of TID: {tid} after {attempts} attempts. ({e})')
+                            continue
+                    failures += 1
+                    self._logger.warning(
+                        f'Cannot send {op} of TID: {tid}, {self.pending()} pending. ({e})')
+                    break
+                with self._lock:
+                    self._db.execute('DELETE FROM outbox WHERE id = ?', (row_id,))
+                self.sent += 1
+                failures = 0
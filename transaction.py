@@ -1,17 +1,34 @@
-from datetime import datetime, timedelta
-from firebase import Db, Storage
-from utils.datetimefunc import datetime_to_upload_string
+import time
+from copy import copy
+import cv2
+from datetime import datetime, timedelta, timezone
+from threading import Event, Lock, Thread
+from types import MappingProxyType
+from google.api_core.exceptions import NotFound, PermissionDenied, InvalidArgument, ServiceUnavailable, \
+    DeadlineExceeded, RetryError
+from firebase import Db
 from utils.logger import getLogger
-from hikvisionapi import Client as HikvisionClient
-from config import DVR_IP_ADDR, DVR_PASSWORD, DVR_USERNAME, ENTRANCE_CHANNEL, EXIT_CHANNEL, DEV
+from utils.fuzzy import PlateIndex
+from utils.framebuffer import FrameRingBuffer, frame_buffer_name
+from uploader import ImageUploader
+from dvr import DvrClient
+from store import TransactionStore
+from config import ENTRANCE_CHANNEL, EXIT_CHANNEL, DEV, FUZZY_MAX_DISTANCE, SNAPSHOT_SOURCE, SNAPSHOT_MAX_AGE, \
+    WINDOW_DAYS, WINDOW_ROLL_INTERVAL, WINDOW_MAX_CLOSED
 
 
 class Transaction(object):
 
-    list = dict()
+    list = MappingProxyType({})  # Read only, same as _view.transactions.
+    _view = None  # Latest TransactionView, set below.
+    _publish_lock = Lock()
+    _uploader = None  # ImageUploader, set below.
+    _store = TransactionStore()
+    _window = None  # TransactionWindow, set below.
     ref = Db.collection("transactions")
+    _listeners = []
     _logger = getLogger('Transaction')
-    _dvr = None if DEV else HikvisionClient(f'http://{DVR_IP_ADDR}', DVR_USERNAME, DVR_PASSWORD)
+    _dvr = None if DEV else DvrClient()
 
     def __init__(
         self,
@@ -43,72 +60,126 @@ class Transaction(object):
         )
 
     @staticmethod
-    def on_transactions_snapshot(collection, changes, read_time):
-        for change in changes:
-            if change.type.name == "ADDED":
-                Transaction.list.update(
-                    {change.document.id: Transaction.from_dict(change.document.to_dict())})
-            elif change.type.name == "MODIFIED":
-                transaction = Transaction.list.get(change.document.id, None)
-                if transaction is None:
-                    Transaction.list.update(
-                        {change.document.id: Transaction.from_dict(change.document.to_dict())})
-                else:
-                    transaction.update(change.document.to_dict())
-            elif change.type.name == "REMOVED":
-                Transaction.list.pop(change.document.id, None)
+    def from_changes(changes):
+        # Firestore changes as [(kind, tid, data)], with the local writes not sent yet on top.
+        changes = [(change.type.name, change.document.id, change.document.to_dict()) for change in changes]
+        store = Transaction._store
+        pending = store.pending_tids()
+        if len(pending) != 0:
+            changes = [(kind, tid, store.overlay(tid, data) if tid in pending and kind != "REMOVED" else data)
+                       for kind, tid, data in changes]
+        return changes
+
+    @staticmethod
+    def _publish(changes: list, read_time=None, persist: bool = True):
+        # changes: [(kind, tid, data)], kind: "ADDED", "MODIFIED" or "REMOVED".
+        with Transaction._publish_lock:
+            view = Transaction._view.apply(changes, read_time)
+            Transaction._view = view  # readers switch atomically.
+            Transaction.list = view.transactions
+            if persist:
+                Transaction._store.apply(changes, read_time)
+        Transaction._logger.debug(f"Transactions published. {Transaction.stats()}")
+        for listener in Transaction._listeners:
+            listener()
+
+    @staticmethod
+    def _send(op: str, tid: str, data: dict):
+        # Write an outbox entry to Firestore.
+        document = Transaction.ref.document(tid)
+        if op == "set":
+            document.set(data, merge=True)
+            return
+        try:
+            document.update(data)
+        except NotFound:
+            Transaction._logger.error(f"Cannot update TID: {tid}. (Reason: Transaction is deleted.)")
+
+    @staticmethod
+    def _patch(tid: str, data: dict):
+        # Image urls from the uploader, sent after the transaction itself.
+        Transaction._store.enqueue("update", tid, data)
+
+    @staticmethod
+    def add_listener(callback):
+        # Called after every snapshot of the transactions.
+        Transaction._listeners.append(callback)
+
+    @staticmethod
+    def stats():
+        view = Transaction._view
+        return {
+            'version': view.version,
+            'transactions': len(view.transactions),
+            'open': len(view.open_index),
+            'unpaid_out': len(view.unpaid_out_index),
+            'build_ms': view.build_time * 1E3,
+            'lag_ms': view.lag * 1E3,
+            'outbox': Transaction._store.pending(),
+            **(Transaction._window.stats() if Transaction._window is not None else {}),
+        }
 
     @staticmethod
     def is_license_number_exists(license_number: str):
-        for tid, transaction in Transaction.list.items():
-            if transaction.license_number == license_number:
-                if transaction.is_out() is False:
-                    Transaction._logger.info(
-                        f"License number: {license_number} [EXISTS] | TID: {tid}")
-                    return True, tid
+        tid = next(iter(Transaction._view.open_index.get(license_number, ())), None)
+        if tid is not None:
+            Transaction._logger.info(
+                f"License number: {license_number} [EXISTS] | TID: {tid}")
+            return True, tid
         Transaction._logger.info(
             f"License number: {license_number} [NOT EXISTS]")
         return False, None
 
     @staticmethod
     def is_license_number_unpaid(license_number: str):
-        for tid, transaction in Transaction.list.items():
-            if transaction.license_number == license_number:
-                if transaction.is_paid() is False and transaction.is_out() is True:
-                    Transaction._logger.info(
-                        f"License number: {license_number} [UNPAID] | TID: {tid}")
-                    return True, tid
+        tid = next(iter(Transaction._view.unpaid_out_index.get(license_number, ())), None)
+        if tid is not None:
+            Transaction._logger.info(
+                f"License number: {license_number} [UNPAID] | TID: {tid}")
+            return True, tid
         Transaction._logger.info(
             f"License number: {license_number} [NO UNPAID]")
         return False, None
 
     @staticmethod
-    def get_image(type: str):
+    def find_license_number(license_number: str, max_distance: float = FUZZY_MAX_DISTANCE):
+        # Open transactions with a similar license number, nearest first. [(distance, license_number, tid)]
+        view = Transaction._view
+        matches = []
+        for distance, match in view.plate_index.search(license_number, max_distance):
+            for tid in view.open_index.get(match, ()):
+                matches.append((distance, match, tid))
+        return matches
+
+    @staticmethod
+    def get_image(type: str) -> bytes:
+        # JPEG picture of the gate, type: "in" or "out".
+        if SNAPSHOT_SOURCE == "alpr":
+            image = Transaction._get_stream_image(type)
+            if image is not None:
+                return image
         if DEV:
             raise
-        response = Transaction._dvr.Streaming.channels[ENTRANCE_CHANNEL if type == "in" else EXIT_CHANNEL].picture(
-            method='get', type='opaque_data')
-        with open(f'{type}.jpg', 'wb') as f:
-            # Save image.
-            for chunk in response.iter_content(chunk_size=1024):
-                if chunk:
-                    f.write(chunk)
+        return Transaction._dvr.snapshot(ENTRANCE_CHANNEL if type == "in" else EXIT_CHANNEL)
 
     @staticmethod
-    def _upload_image(license_number: str, timestamp: datetime, type: str):
+    def _get_stream_image(type: str):
+        # Latest frame decoded by the ALPR stream of the gate, None if it is unavailable or too old.
         try:
-            # Get image.
-            Transaction.get_image(str)
-            # Upload image.
-            ref = Storage.blob(
-                f'transactions/{timestamp.strftime("%Y-%m-%d")}/{type}/{datetime_to_upload_string(timestamp)}_{license_number}.jpg')
-            ref.upload_from_filename(f'{type}.jpg')
-            ref.make_public()
-            return ref.public_url
-        except Exception:
-            Transaction._logger.error(
-                f'Cannot upload {"Entrance" if type == "in" else "Exit"} image.')
+            buffer = FrameRingBuffer(frame_buffer_name(
+                "entrance" if type == "in" else "exit"), create=False)
+        except FileNotFoundError:
             return None
+        try:
+            if time.time() - buffer.timestamp > SNAPSHOT_MAX_AGE:
+                return None
+            seq, frame = buffer.snapshot()
+            if frame is None:
+                return None
+            success, image = cv2.imencode('.jpg', frame)
+            return image.tobytes() if success else None
+        finally:
+            buffer.close()
 
     @staticmethod
     def add(license_number: str):
@@ -127,20 +198,20 @@ class Transaction(object):
         # Format info.
         info = {"license_number": license_number,
                 "timestamp_in": datetime.now()}
-        # Upload image.
-        image = Transaction._upload_image(
-            license_number, info.get("timestamp_in"), "in")
-        if image is not None:
-            info.update({"image_in": image})
-        # Add transaction.
-        update_time, ref = Transaction.ref.add(info)
+        # Add transaction, locally first and to Firestore through the outbox.
+        tid = Transaction.ref.document().id  # generated on the client, no round trip.
+        Transaction._store.enqueue("set", tid, info)  # pending first, a snapshot in between keeps it.
+        Transaction._publish([("ADDED", tid, info)])
         Transaction._logger.info(
-            f'Transaction added. [License number: {license_number} | TID: {ref.id}]')
-        return True, ref.id
+            f'Transaction added. [License number: {license_number} | TID: {tid}]')
+        # Upload image in the background, image_in is added to the transaction later.
+        Transaction._uploader.submit(
+            tid, license_number, info.get("timestamp_in"), "in")
+        return True, tid
 
     @staticmethod
     def get(tid: str):
-        return Transaction.list.get(tid, None)
+        return Transaction._view.transactions.get(tid, None)
 
     def update(self, data: dict):
         self.tid = data.get("tid", self.tid)
@@ -160,16 +231,219 @@ class Transaction(object):
     def closed(self):
         # Format info.
         info = {"timestamp_out": datetime.now(), "is_edit": True}
-        # Upload image.
-        image = Transaction._upload_image(
-            self.license_number, info.get("timestamp_out"), "out")
-        if image is not None:
-            info.update({"image_out": image})
-        # Close transaction.
-        update_time = Db.collection(
-            "transactions").document(self.tid).update(info)
+        # Close transaction, locally first and to Firestore through the outbox.
+        Transaction._store.enqueue("update", self.tid, info)
+        Transaction._publish([("MODIFIED", self.tid, info)])
         Transaction._logger.info(f"Transaction closed. [TID: {self.tid}]")
+        # Upload image in the background, image_out is added to the transaction later.
+        Transaction._uploader.submit(
+            self.tid, self.license_number, info.get("timestamp_out"), "out")
+
+
+class TransactionView:
+    # Immutable snapshot of the transaction cache.
+    # Every Firestore snapshot builds a new view from the previous one (copy on write),
+    # readers take Transaction._view once and get a consistent state without locks.
+    def __init__(self, transactions=None, open_index=None, unpaid_out_index=None, indexed=None,
+                 plate_index=None, version: int = 0):
+        self.transactions = MappingProxyType(transactions or {})  # tid -> Transaction.
+        # license_number -> {tid: None} in insertion order.
+        self.open_index = open_index or {}  # Not out yet.
+        self.unpaid_out_index = unpaid_out_index or {}  # Out without payment.
+        self.indexed = indexed or {}  # tid -> (license_number, open) it is indexed under.
+        self.plate_index = plate_index or PlateIndex(max_distance=FUZZY_MAX_DISTANCE)  # Keys of open_index.
+        self.version = version
+        self.build_time = 0.0  # Seconds to build this view.
+        self.lag = 0.0  # Seconds from the snapshot read time to publishing.
+
+    def apply(self, changes, read_time=None) -> 'TransactionView':
+        t = time.perf_counter()
+        view = TransactionView(None, dict(self.open_index), dict(self.unpaid_out_index),
+                               dict(self.indexed), self.plate_index.copy(), self.version + 1)
+        transactions = dict(self.transactions)
+        for kind, tid, data in changes:
+            if kind == "REMOVED":
+                transactions.pop(tid, None)
+            else:
+                old = transactions.get(tid, None)
+                if kind == "MODIFIED" and old is not None:
+                    transaction = copy(old)  # published transactions are never mutated.
+                    transaction.update(data)
+                else:
+                    transaction = Transaction.from_dict({"tid": tid, **data})
+                transactions[tid] = transaction
+            view._index(tid, transactions.get(tid, None))
+        view.transactions = MappingProxyType(transactions)
+        view.build_time = time.perf_counter() - t
+        if isinstance(read_time, datetime):
+            view.lag = max((datetime.now(timezone.utc) - read_time).total_seconds(), 0)
+        return view
+
+    def _index(self, tid: str, transaction: Transaction):
+        # Move tid to the index matching its transaction, inner dicts are replaced, not mutated.
+        old = self.indexed.pop(tid, None)
+        if old is not None:
+            license_number, is_open = old
+            index = self.open_index if is_open else self.unpaid_out_index
+            tids = {k: None for k in index[license_number] if k != tid}
+            if len(tids) != 0:
+                index[license_number] = tids
+            else:
+                del index[license_number]
+                if is_open:
+                    self.plate_index.discard(license_number)
+        if transaction is None:
+            return
+        is_open = transaction.is_out() is False
+        if not is_open and transaction.is_paid() is True:
+            return
+        index = self.open_index if is_open else self.unpaid_out_index
+        index[transaction.license_number] = {**index.get(transaction.license_number, {}), tid: None}
+        if is_open:
+            self.plate_index.add(transaction.license_number)
+        self.indexed[tid] = (transaction.license_number, is_open)
+
+
+def _utc(value: datetime):
+    # Local writes hold naive local times, Firestore returns aware UTC times.
+    return value.astimezone(timezone.utc) if isinstance(value, datetime) else None
+
+
+class TransactionWindow:
+    # Firestore listener over the last days of transactions, rolled forward every interval.
+    # Closed transactions leave the cache with the window, or oldest first above max_closed.
+    # Open and unpaid transactions are kept regardless of age, older ones through a listener on their document.
+    def __init__(
+        self,
+        days: float = WINDOW_DAYS,  # Days of transactions in the listener query.
+        interval: float = WINDOW_ROLL_INTERVAL,  # Seconds between rolling the query forward.
+        max_closed: int = WINDOW_MAX_CLOSED,  # Closed transactions cached, oldest are evicted above it.
+    ):
+        self.days = days
+        self.interval = interval
+        self.max_closed = max_closed
+        self.start = None  # Start of the current query.
+        self._logger = getLogger('Window')
+        self._watch = None  # Current query {"start", "watch", "synced"}.
+        self._next = None  # Query replacing the current one once synced.
+        self._pinned = {}  # tid -> document watch of transactions older than the window.
+        self._wakeup = Event()
+
+        # > Stats
+        self.rolls = 0
+        self.evicted_age = 0
+        self.evicted_size = 0
+
+        self._thread = Thread(target=self._process, daemon=True)
+        self._thread.start()
+
+    def stats(self):
+        return {
+            'window_start': self.start,
+            'rolls': self.rolls,
+            'pinned': len(self._pinned),
+            'evicted_age': self.evicted_age,
+            'evicted_size': self.evicted_size,
+        }
+
+    # > Listener functions
+    def roll(self):
+        # Listen to a new query, the current one keeps serving until its first snapshot.
+        query = {"start": datetime.now(timezone.utc) - timedelta(days=self.days), "synced": False}
+        query["watch"] = Transaction.ref.where("timestamp_in", ">=", query["start"]).on_snapshot(
+            lambda docs, changes, read_time: self._on_snapshot(query, changes, read_time))
+        self._next = query
+
+    def _on_snapshot(self, query: dict, changes, read_time):
+        changes = Transaction.from_changes(changes)
+        if query["synced"] is False:
+            # The first snapshot holds every transaction of the query, drop the cached ones outside it.
+            # (deleted meanwhile, or older than the window and closed)
+            tids = {tid for _, tid, _ in changes}
+            view = Transaction._view  # before the outbox, local writes are enqueued before they are published.
+            pending = Transaction._store.pending_tids()
+            removed = []
+            for tid, transaction in view.transactions.items():
+                if tid in tids or tid in pending:
+                    continue
+                timestamp_in = _utc(transaction.timestamp_in)
+                if tid in view.indexed and (timestamp_in is None or timestamp_in < query["start"]):
+                    continue  # open or unpaid, pinned instead.
+                removed.append(("REMOVED", tid, None))
+            changes += removed
+            self.evicted_age += len(removed)
+            query["synced"] = True
+        Transaction._publish(changes, read_time)
+        self._wakeup.set()
+
+    def _on_document(self, tid: str, docs, changes, read_time):
+        if len(docs) == 0 or not docs[0].exists:
+            changes = [("REMOVED", tid, None)]
+        else:
+            changes = Transaction.from_changes(changes)
+        Transaction._publish(changes, read_time)
+        self._wakeup.set()
+
+    # > Maintenance functions
+    def _process(self):
+        # Watches are only opened and closed here, never from their own callback thread.
+        next_roll = 0
+        while True:
+            self._wakeup.wait(max(next_roll - time.monotonic(), 0))
+            self._wakeup.clear()
+            try:
+                if time.monotonic() >= next_roll:
+                    self.roll()
+                    next_roll = time.monotonic() + self.interval
+                if self._next is not None and self._next["synced"] is True:
+                    old, self._watch, self._next = self._watch, self._next, None
+                    self.start = self._watch["start"]
+                    if old is not None:
+                        old["watch"].unsubscribe()
+                    self.rolls += 1
+                    self._logger.info(f"Window rolled to {self.start}. {Transaction.stats()}")
+                if self.start is not None:
+                    self._pin()
+                    self._evict()
+            except Exception as e:
+                self._logger.error(f"Cannot maintain the window. ({e})")
+
+    def _pin(self):
+        # Listen to open and unpaid transactions older than the window.
+        view = Transaction._view
+        tids = set()
+        for tid in view.indexed:
+            timestamp_in = _utc(view.transactions[tid].timestamp_in)
+            if timestamp_in is None or timestamp_in < self.start:
+                tids.add(tid)
+        for tid in tids - self._pinned.keys():
+            self._pinned[tid] = Transaction.ref.document(tid).on_snapshot(
+                lambda docs, changes, read_time, tid=tid: self._on_document(tid, docs, changes, read_time))
+        for tid in self._pinned.keys() - tids:
+            self._pinned.pop(tid).unsubscribe()
+
+    def _evict(self):
+        # Keep at most max_closed closed transactions, down to 90% so eviction does not run on every snapshot.
+        view = Transaction._view
+        count = len(view.transactions) - len(view.indexed)
+        if count <= self.max_closed:
+            return
+        pending = Transaction._store.pending_tids()
+        oldest = datetime.min.replace(tzinfo=timezone.utc)
+        closed = sorted((_utc(t.timestamp_out) or _utc(t.timestamp_in) or oldest, tid)
+                        for tid, t in view.transactions.items() if tid not in view.indexed and tid not in pending)
+        removed = [("REMOVED", tid, None) for _, tid in closed[:count - int(self.max_closed * 0.9)]]
+        Transaction._publish(removed)
+        self.evicted_size += len(removed)
+        self._logger.info(f"Evicted {len(removed)} closed transactions. {Transaction.stats()}")
 
 
-Transaction.ref.where("timestamp_in", ">=", datetime.now(
-) - timedelta(weeks=4)).on_snapshot(Transaction.on_transactions_snapshot)
+Transaction._view = TransactionView()
+Transaction._publish([("ADDED", tid, data) for tid, data in Transaction._store.load()], persist=False)
+Transaction._logger.info(
+    f"Transactions loaded from the local store, synced at {Transaction._store.read_time()}. {Transaction.stats()}")
+Transaction._store.start_sync(Transaction._send,
+                              transient=(ServiceUnavailable, DeadlineExceeded, RetryError, OSError),
+                              permanent=(PermissionDenied, InvalidArgument))
+Transaction._uploader = ImageUploader(Transaction.get_image, patch=Transaction._patch)
+Transaction._window = TransactionWindow()
@@ -0,0 +1,170 @@
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from queue import Queue
+from threading import Lock, Thread, Timer
+from firebase import Db, Storage
+from utils.datetimefunc import datetime_to_upload_string
+from utils.logger import getLogger
+from config import UPLOAD_WORKERS, UPLOAD_SPOOL, UPLOAD_MAX_ATTEMPTS, UPLOAD_RETRY_DELAY
+
+
+class ImageUploader:
+    # Background capture, upload and patch of transaction images.
+    # Every job is journaled in the spool directory, so uploads resume after a restart.
+    # Images are uploaded from memory, the copy in the spool is only read after a retry or restart.
+    # Stages: capture (gate picture) -> upload (Cloud Storage) -> patch (image_in/image_out of the document).
+    # Pictures are captured as soon as they are submitted, never behind slow uploads, the workers upload and patch.
+    def __init__(
+        self,
+        capture,  # capture(type) returns the gate picture as JPEG bytes.
+        patch=None,  # patch(tid, data) writes the image url to the transaction. (None: Firestore update)
+        workers: int = UPLOAD_WORKERS,  # Number of worker threads.
+        spool: str = UPLOAD_SPOOL,  # Directory of the job journal and images.
+        max_attempts: int = UPLOAD_MAX_ATTEMPTS,  # Attempts per job before giving up.
+        retry_delay: float = UPLOAD_RETRY_DELAY,  # Seconds before the first retry, doubled each attempt.
+    ):
+        self._capture = capture
+        self._patch = patch or (lambda tid, data: Db.collection("transactions").document(tid).update(data))
+        self.spool = spool
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._logger = getLogger('Uploader')
+        self._queue = Queue()
+        self._capturer = ThreadPoolExecutor(max_workers=2, thread_name_prefix='capture')  # one per gate.
+        self._lock = Lock()
+        self._retries = {}  # job id -> retry Timer.
+
+        # > Stats
+        self.uploaded = 0
+        self.retried = 0
+        self.failed = 0
+
+        os.makedirs(self.spool, exist_ok=True)
+        self._resume()
+        self._threads = [Thread(target=self._process, daemon=True) for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    # > Journal functions
+    def _path(self, job: dict, ext: str):
+        return os.path.join(self.spool, f'{job["id"]}.{ext}')
+
+    def _save(self, job: dict):
+        tmp = self._path(job, 'json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({k: v for k, v in job.items() if k != 'image'}, f)
+        os.replace(tmp, self._path(job, 'json'))  # atomic.
+
+    def _remove(self, job: dict):
+        for ext in ('json', 'jpg'):
+            if os.path.exists(self._path(job, ext)):
+                os.remove(self._path(job, ext))
+
+    def _resume(self):
+        for name in sorted(os.listdir(self.spool)):
+            if not name.endswith('.json'):
+                continue
+            with open(os.path.join(self.spool, name)) as f:
+                job = json.load(f)
+            if job['stage'] == 'capture':  # the car has left, a new picture is useless.
+                self._logger.warning(f'Drop {job["type"]} image of TID: {job["tid"]}, not captured before restart.')
+                self._remove(job)
+                continue
+            if job['stage'] == 'upload' and not os.path.exists(self._path(job, 'jpg')):
+                self._logger.error(f'Drop {job["type"]} image of TID: {job["tid"]}, image is missing.')
+                self._remove(job)
+                continue
+            self._logger.info(f'Resume {job["type"]} image of TID: {job["tid"]}. (stage: {job["stage"]})')
+            self._queue.put(job)
+
+    # > Queue functions
+    def submit(self, tid: str, license_number: str, timestamp: datetime, type: str):
+        # Queue the gate picture of a transaction, type: "in" or "out".
+        job = {
+            'id': uuid.uuid4().hex,
+            'tid': tid,
+            'license_number': license_number,
+            'timestamp': timestamp.isoformat(),
+            'type': type,
+            'stage': 'capture',
+            'attempts': 0,
+            'url': None,
+        }
+        self._save(job)
+        self._capturer.submit(self._capture_job, job)
+
+    def depth(self):
+        return self._queue.qsize() + len(self._retries)
+
+    def stats(self):
+        return {'depth': self.depth(), 'uploaded': self.uploaded, 'retried': self.retried, 'failed': self.failed}
+
+    # > Worker functions
+    def _process(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._run(job)
+            except Exception as e:
+                self._retry(job, e)
+
+    def _capture_job(self, job: dict):
+        try:
+            job['image'] = self._capture(job['type'])
+        except Exception as e:
+            self._logger.error(f'Cannot capture {job["type"]} image of TID: {job["tid"]}. ({e})')
+            self.failed += 1
+            return self._remove(job)
+        with open(self._path(job, 'jpg'), 'wb') as f:  # the upload stage survives a restart.
+            f.write(job['image'])
+        job['stage'] = 'upload'
+        self._save(job)
+        self._queue.put(job)
+
+    def _run(self, job: dict):
+        if job['stage'] == 'upload':
+            timestamp = datetime.fromisoformat(job['timestamp'])
+            blob = Storage.blob(
+                f'transactions/{timestamp.strftime("%Y-%m-%d")}/{job["type"]}/{datetime_to_upload_string(timestamp)}_{job["license_number"]}.jpg')
+            if 'image' in job:
+                blob.upload_from_string(job['image'], content_type='image/jpeg')
+            else:  # resumed or retried.
+                blob.upload_from_filename(self._path(job, 'jpg'), content_type='image/jpeg')
+            job.pop('image', None)
+            blob.make_public()
+            job['url'] = blob.public_url
+            job['stage'] = 'patch'
+            self._save(job)
+        if job['stage'] == 'patch':
+            self._patch(job['tid'], {f'image_{job["type"]}': job['url']})
+            self._remove(job)
+            self.uploaded += 1
+            self._logger.info(f'Uploaded {job["type"]} image of TID: {job["tid"]}.')
+
+    def _retry(self, job: dict, error: Exception):
+        job['attempts'] += 1
+        job.pop('image', None)  # retried from the spool.
+        if job['attempts'] >= self.max_attempts:
+            self.failed += 1
+            self._logger.error(
+                f'Give up {job["type"]} image of TID: {job["tid"]} after {job["attempts"]} attempts. ({error})')
+            os.replace(self._path(job, 'json'), self._path(job, 'failed'))  # kept for manual upload.
+            return
+        self._save(job)
+        self.retried += 1
+        delay = self.retry_delay * 2 ** (job['attempts'] - 1)
+        self._logger.warning(
+            f'Cannot {job["stage"]} {job["type"]} image of TID: {job["tid"]}, retry in {delay:.0f}s. ({error})')
+        timer = Timer(delay, self._requeue, args=(job,))
+        timer.daemon = True
+        with self._lock:
+            self._retries[job['id']] = timer
+        timer.start()
+
+    def _requeue(self, job: dict):
+        with self._lock:
+            self._retries.pop(job['id'], None)
+        self._queue.put(job)
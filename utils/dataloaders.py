@@ -15,7 +15,7 @@ import time
 from itertools import repeat
 from multiprocessing.pool import Pool, ThreadPool
 from pathlib import Path
-from threading import Thread
+from threading import Condition, Thread, current_thread
 from urllib.parse import urlparse
 from zipfile import ZipFile
 
@@ -27,6 +27,8 @@ from PIL import ExifTags, Image, ImageOps
 from torch.utils.data import DataLoader, Dataset, dataloader, distributed
 from tqdm import tqdm
 
+from utils.framebuffer import FrameRingBuffer
+from utils.decoders import create_decoder
 from utils.augmentations import Albumentations, augment_hsv, copy_paste, letterbox, mixup, random_perspective
 from utils.general import (DATASETS_DIR, LOGGER, NUM_THREADS, check_dataset, check_requirements, check_yaml, clean_str,
                            cv2, is_colab, is_kaggle, segments2boxes, xyn2xy, xywh2xyxy, xywhn2xyxy, xyxy2xywhn)
@@ -317,16 +319,39 @@ class LoadWebcam:  # for inference
         return 0
 
 
+def roi_rect(roi, shape):
+    # Crop rectangle (x1, y1, x2, y2) of a rectangle or polygon ROI, clipped to an image shape
+    h, w = shape[:2]
+    if roi is None:
+        return 0, 0, w, h
+    if len(roi) == 4 and not isinstance(roi[0], (list, tuple)):  # rectangle
+        x1, y1, x2, y2 = roi
+    else:  # polygon, use its bounding box
+        xs, ys = [p[0] for p in roi], [p[1] for p in roi]
+        x1, y1, x2, y2 = min(xs), min(ys), max(xs), max(ys)
+    x1, x2 = max(0, min(int(x1), w - 1)), max(1, min(int(x2), w))
+    y1, y2 = max(0, min(int(y1), h - 1)), max(1, min(int(y2), h))
+    assert x1 < x2 and y1 < y2, f'Invalid region of interest {roi} for frame size {w}x{h}'
+    return x1, y1, x2, y2
+
+
 class LoadStreams:
     # YOLOv5 streamloader, i.e. `python detect.py --source 'rtsp://example.com/media.mp4'  # RTSP, RTMP, HTTP streams`
-    def __init__(self, sources='streams.txt', img_size=640, stride=32, auto=True):
+    def __init__(self, sources='streams.txt', img_size=640, stride=32, auto=True, buffers=None, transforms=None,
+                 rois=None):
+        # buffers: optional shared memory names of the frame ring buffers, one per source
+        # rois: optional crop per source, (x1, y1, x2, y2) or polygon [(x, y), ...], None for full frame
+        # transforms: optional callable replacing letterbox/stack/convert, i.e. utils.preprocess.Preprocessor
         self.mode = 'stream'
+        self.transforms = transforms
         self.img_size = img_size
         self.stride = stride
 
         os.environ['OPENCV_FFMPEG_CAPTURE_OPTIONS'] = 'rtsp_transport;udp'
 
-        if os.path.isfile(sources):
+        if isinstance(sources, (list, tuple)):  # several sources in one batch
+            sources = [str(x) for x in sources]
+        elif os.path.isfile(sources):
             with open(sources) as f:
                 sources = [x.strip() for x in f.read(
                 ).strip().splitlines() if len(x.strip())]
@@ -334,8 +359,15 @@ class LoadStreams:
             sources = [sources]
 
         n = len(sources)
-        self.imgs, self.fps, self.frames, self.threads = [
+        self.buffers, self.fps, self.frames, self.threads = [
             None] * n, [0] * n, [0] * n, [None] * n
+        self.seqs = [0] * n  # sequence number of the frames last returned
+        self.rois = [None] * n  # crop rectangle (x1, y1, x2, y2) per source
+        self.counters = [{'decoded': 0, 'retrieved': 0, 'consumed': 0} for _ in range(n)]
+        self.consume_interval = 0.0  # seconds the consumer is busy between frames, moving average
+        self.last_consumed = 0.0  # time.monotonic() of the last frames taken
+        self.new_frame = Condition()  # notified by capture threads
+        self.stopped = False  # set by close(), ends the capture threads
         # clean source names for later
         self.sources = [clean_str(x) for x in sources]
         self.auto = auto
@@ -353,17 +385,17 @@ class LoadStreams:
                 assert not is_colab(), '--source 0 webcam unsupported on Colab. Rerun command in a local environment.'
                 assert not is_kaggle(
                 ), '--source 0 webcam unsupported on Kaggle. Rerun command in a local environment.'
-            cap = cv2.VideoCapture(s)
+            cap = create_decoder(s)  # backend from config.DECODER
             assert cap.isOpened(), f'{st}Failed to open {s}'
-            w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            fps = cap.get(cv2.CAP_PROP_FPS)  # warning: may return 0 or nan
-            self.frames[i] = max(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 0) or float(
-                'inf')  # infinite stream fallback
-            self.fps[i] = max((fps if math.isfinite(fps) else 0) %
-                              100, 0) or 30  # 30 FPS fallback
-
-            _, self.imgs[i] = cap.read()  # guarantee first frame
+            w, h, fps = cap.width, cap.height, cap.fps  # warning: fps may return 0
+            self.frames[i] = cap.frames  # infinite stream fallback
+            self.fps[i] = max(fps % 100, 0) or 30  # 30 FPS fallback
+
+            _, im = cap.read()  # guarantee first frame
+            self.buffers[i] = FrameRingBuffer(
+                buffers[i] if buffers else None, im.shape)
+            self.buffers[i].write(im)
+            self.rois[i] = roi_rect(rois[i] if rois else None, im.shape)
             self.threads[i] = Thread(
                 target=self.update, args=([i, cap, s]), daemon=True)
             LOGGER.info(
@@ -372,8 +404,8 @@ class LoadStreams:
         LOGGER.info('')  # newline
 
         # check for common shapes
-        s = np.stack([letterbox(x, self.img_size, stride=self.stride, auto=self.auto)[
-                     0].shape for x in self.imgs])
+        s = np.stack([letterbox(self.crop(x.latest(pin=False)[1], i), self.img_size, stride=self.stride, auto=self.auto)[
+                     0].shape for i, x in enumerate(self.buffers)])
         # rect inference if all shapes equal
         self.rect = np.unique(s, axis=0).shape[0] == 1
         if not self.rect:
@@ -381,23 +413,42 @@ class LoadStreams:
                 'WARNING: Stream shapes differ. For optimal performance supply similarly-shaped streams.')
 
     def update(self, i, cap, stream):
-        # Read stream `i` frames in daemon thread
-        # frame number, frame array, inference every 'read' frame
-        n, f, read = 0, self.frames[i], 1
-        while cap.isOpened() and n < f:
+        # Read stream `i` frames in daemon thread, straight into its ring buffer
+        # Every frame is grabbed to keep the stream current, but only retrieved (converted and copied)
+        # when the consumer is about to take the next one
+        n, f = 0, self.frames[i]
+        buffer, stats = self.buffers[i], self.counters[i]
+        is_file = math.isfinite(f)  # finite frame count, pace to the file's FPS instead of spinning
+        while cap.isOpened() and n < f and not self.stopped:
+            t = time.monotonic()
             n += 1
-            # _, self.imgs[i] = cap.read()
-            cap.grab()
-            if n % read == 0:
-                success, im = cap.retrieve()
+            success = cap.grab()
+            stats['decoded'] += 1
+            if success and t < self.last_consumed + 0.8 * self.consume_interval:
+                pass  # consumer not ready yet, skip this frame
+            else:
+                index, view = buffer.slot()
                 if success:
-                    self.imgs[i] = im
+                    success, im = cap.retrieve(view)
+                if success:
+                    if im is not view:  # decoded into a new array, i.e. resolution changed
+                        cv2.resize(im, view.shape[1::-1], dst=view)
+                    stats['retrieved'] += 1
                 else:
                     LOGGER.warning(
                         'WARNING: Video stream unresponsive, please check your IP camera connection.')
-                    self.imgs[i] = np.zeros_like(self.imgs[i])
-                    cap.open(stream)  # re-open stream if signal was lost
-            time.sleep(0.0)  # wait time
+                    view[:] = 0
+                    cap.open()  # re-open stream if signal was lost
+                buffer.publish(index)
+                with self.new_frame:
+                    self.new_frame.notify()
+            if is_file:
+                time.sleep(max(0.0, 1 / self.fps[i] - (time.monotonic() - t)))
+
+    def stats(self):
+        # Per stream counters: decoded, retrieved, consumed and dropped (decoded but never consumed) frames
+        return [{**x, 'dropped': x['decoded'] - x['consumed'], 'interval': self.consume_interval}
+                for x in self.counters]
 
     def __iter__(self):
         self.count = -1
@@ -405,14 +456,41 @@ class LoadStreams:
 
     def __next__(self):
         self.count += 1
+
+        # Consumer speed, moving average of the time spent outside __next__, not of the wait for frames,
+        # which the capture throttle itself stretches
+        if self.last_consumed:
+            busy = time.monotonic() - self.last_consumed
+            self.consume_interval = 0.9 * self.consume_interval + 0.1 * busy
         if not all(x.is_alive() for x in self.threads):  # q to quit
             cv2.destroyAllWindows()
+            self.close()
             raise StopIteration
 
+        # Wait for a frame that has not been returned yet
+        with self.new_frame:
+            self.new_frame.wait_for(lambda: any(
+                x.seq != seq for x, seq in zip(self.buffers, self.seqs)), timeout=1)
+
+        # Latest frames, zero-copy views pinned until the next call
+        img0 = []
+        for i, buffer in enumerate(self.buffers):
+            seq, im = buffer.latest()
+            if seq != self.seqs[i]:
+                self.counters[i]['consumed'] += 1
+            self.seqs[i] = seq
+            img0.append(im)
+
+        self.last_consumed = time.monotonic()
+
+        # Crop to the region of interest, zero-copy
+        img = [self.crop(x, i) for i, x in enumerate(img0)]
+        if self.transforms:
+            return self.sources, self.transforms(img), img0, None, ''
+
         # Letterbox
-        img0 = self.imgs.copy()
         img = [letterbox(x, self.img_size, stride=self.stride,
-                         auto=self.rect and self.auto)[0] for x in img0]
+                         auto=self.rect and self.auto)[0] for x in img]
 
         # Stack
         img = np.stack(img, 0)
@@ -424,6 +502,21 @@ class LoadStreams:
 
         return self.sources, img, img0, None, ''
 
+    def crop(self, im, i):
+        # Region of interest of stream `i`, as a view
+        x1, y1, x2, y2 = self.rois[i]
+        return im[y1:y2, x1:x2]
+
+    def close(self):
+        # Stop the capture threads, then release the shared memory of the frame ring buffers
+        # A thread still blocked in its decoder keeps its buffer, released with the process
+        self.stopped = True
+        for thread, buffer in zip(self.threads, self.buffers):
+            if thread is not None and thread.is_alive() and thread is not current_thread():
+                thread.join(timeout=5)
+            if buffer is not None and not (thread is not None and thread.is_alive()):
+                buffer.close()
+
     def __len__(self):
         # 1E12 frames = 32 streams at 30 FPS for 30 years
         return len(self.sources)
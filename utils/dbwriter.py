@@ -0,0 +1,169 @@
+import atexit
+import time
+from threading import Event, Lock, Thread
+from utils.logger import getLogger
+from config import DB_WRITE_INTERVAL
+
+
+class BufferedReference:
+    # Write side of a database reference, writes go through a DbWriter.
+    def __init__(self, writer, path: str):
+        self._writer = writer
+        self.path = path.strip('/')
+
+    def child(self, path: str):
+        return BufferedReference(self._writer, f'{self.path}/{path.strip("/")}')
+
+    def set(self, value, urgent: bool = False):
+        self._writer.set(self.path, value, urgent)
+
+    def update(self, values: dict, urgent: bool = False):
+        # values: relative path -> value, as in reference.update().
+        for path, value in values.items():
+            self._writer.set(f'{self.path}/{path.strip("/")}', value, urgent=False)
+        if urgent:
+            self._writer.flush_soon()
+
+
+class DbWriter:
+    # Write-behind queue for Realtime Database.
+    # Writes to the same path are coalesced and flushed every interval as one multi-path update.
+    def __init__(
+        self,
+        reference=None,  # Root reference with update(). (None: TempDb root)
+        interval: float = DB_WRITE_INTERVAL,  # Seconds between flushes.
+    ):
+        if reference is None:
+            from firebase import TempDb
+            reference = TempDb.reference('/')
+        self._reference = reference
+        self.interval = interval
+        self._logger = getLogger('DbWriter')
+        self._pending = {}  # path -> value.
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._wakeup = Event()
+        self._stop_event = Event()
+        self._thread = None
+
+        # > Stats
+        self.flushes = 0
+        self.writes = 0  # Paths written.
+        self.coalesced = 0  # Writes replaced before they were flushed.
+        self.errors = 0
+        self.last_latency = 0.0  # Seconds.
+        self._total_latency = 0.0
+
+    def reference(self, path: str):
+        return BufferedReference(self, path)
+
+    # > Queue functions
+    def set(self, path: str, value, urgent: bool = False):
+        with self._lock:
+            self._put(path.strip('/'), value)
+        self._start()
+        if urgent:
+            self.flush_soon()
+
+    def _put(self, path: str, value):
+        # Overlapping paths are not allowed in one update, merge them.
+        for p in [p for p in self._pending if p.startswith(path + '/')]:
+            del self._pending[p]
+            self.coalesced += 1
+        ancestor = next((p for p in self._pending if path.startswith(p + '/')), None)
+        if ancestor is None:
+            if path in self._pending:
+                self.coalesced += 1
+            self._pending[path] = value
+            return
+        self.coalesced += 1
+        keys = path[len(ancestor) + 1:].split('/')
+        root = self._pending[ancestor]
+        root = dict(root) if isinstance(root, dict) else {}
+        node = root
+        for key in keys[:-1]:
+            node[key] = dict(node[key]) if isinstance(node.get(key), dict) else {}
+            node = node[key]
+        if value is None:
+            node.pop(keys[-1], None)
+        else:
+            node[keys[-1]] = value
+        self._pending[ancestor] = root
+
+    def depth(self):
+        return len(self._pending)
+
+    # > Flush functions
+    def flush_soon(self):
+        self._wakeup.set()
+
+    def flush(self):
+        # Write the pending paths now, returns the number of paths written.
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if len(batch) == 0:
+                return 0
+            t = time.perf_counter()
+            try:
+                self._reference.update(batch)
+            except Exception as e:
+                self.errors += 1
+                self._logger.warning(f'Cannot flush {len(batch)} paths, retry later. ({e})')
+                with self._lock:  # requeue under the newer writes.
+                    newer, self._pending = self._pending, {}
+                    for path, value in [*batch.items(), *newer.items()]:
+                        self._put(path, value)
+                return 0
+            self.last_latency = time.perf_counter() - t
+            self._total_latency += self.last_latency
+            self.flushes += 1
+            self.writes += len(batch)
+            return len(batch)
+
+    def stats(self):
+        return {
+            'depth': self.depth(),
+            'flushes': self.flushes,
+            'writes': self.writes,
+            'coalesced': self.coalesced,
+            'errors': self.errors,
+            'last_latency_ms': self.last_latency * 1E3,
+            'avg_latency_ms': self._total_latency / max(self.flushes, 1) * 1E3,
+        }
+
+    # > Thread functions
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = Thread(target=self._process, daemon=True)
+                    self._thread.start()
+
+    def _process(self):
+        while not self._stop_event.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def close(self):
+        self._stop_event.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        self._logger.info(f'DbWriter stopped. {self.stats()}')
+
+
+_writer = None
+_writer_lock = Lock()
+
+
+def get_writer():
+    # DbWriter of this process.
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = DbWriter()
+            atexit.register(_writer.close)
+    return _writer
@@ -0,0 +1,273 @@
+import math
+from abc import ABC, abstractmethod
+import time
+import cv2
+import numpy as np
+from config import DECODER, DECODER_SCALE, DECODER_KEYFRAME_ONLY, GSTREAMER_DECODER, DECODER_RETRY_MAX
+
+
+class Decoder(ABC):
+    # Stream decoder backend, a subset of cv2.VideoCapture used by LoadStreams.
+    # grab() decodes the next frame, retrieve() converts it to BGR (scaled) and copies it into `image`.
+    def __init__(
+        self,
+        source,  # Stream url, file path or webcam index.
+        scale: tuple = None,  # Output size (width, height). (None: source size)
+        keyframe_only: bool = False,  # Decode key frames only.
+    ):
+        self.source = source
+        self.scale = tuple(scale) if scale else None
+        self.keyframe_only = keyframe_only
+        self.width, self.height = 0, 0  # Output size.
+        self.fps = 0.0  # May be 0 for live streams.
+        self.frames = float('inf')  # Frame count, infinite for live streams.
+        self.failures = 0  # Failed reconnects in a row.
+        self._retry_at = 0.0
+        self.open()
+
+    @abstractmethod
+    def open(self):
+        pass
+
+    @abstractmethod
+    def isOpened(self):
+        pass
+
+    @abstractmethod
+    def grab(self):
+        pass
+
+    @abstractmethod
+    def retrieve(self, image: np.ndarray = None):
+        pass
+
+    def read(self, image: np.ndarray = None):
+        if not self.grab():
+            return False, image
+        return self.retrieve(image)
+
+    def release(self):
+        pass
+
+    def _backoff(self, success: bool):
+        # Delay the next reconnect, doubled per failure up to DECODER_RETRY_MAX seconds.
+        self.failures = 0 if success else self.failures + 1
+        self._retry_at = time.monotonic() + (min(2 ** (self.failures - 1), DECODER_RETRY_MAX) if self.failures else 0)
+
+    def _wait_retry(self):
+        time.sleep(max(self._retry_at - time.monotonic(), 0))
+
+    def _output(self, frame: np.ndarray, image: np.ndarray = None):
+        # Scale the decoded frame if the backend did not, and write it into `image`.
+        if image is None:
+            if self.scale and frame.shape[1::-1] != self.scale:
+                frame = cv2.resize(frame, self.scale, interpolation=cv2.INTER_AREA)
+            return True, frame
+        if frame.shape != image.shape:
+            cv2.resize(frame, image.shape[1::-1], dst=image, interpolation=cv2.INTER_AREA)
+        elif frame is not image:
+            np.copyto(image, frame)
+        return True, image
+
+
+class OpenCVDecoder(Decoder):
+    # cv2.VideoCapture with FFmpeg software decoding. Key frame only mode is not supported.
+    # A failed reconnect keeps the decoder open but disconnected, grab() fails until the next open() succeeds.
+    keyframe_only_support = False
+
+    def open(self):
+        if self.keyframe_only and not self.keyframe_only_support:
+            raise ValueError('OpenCV decoder does not support key frame only mode.')
+        if not hasattr(self, '_cap'):  # first open, LoadStreams checks isOpened().
+            self._cap = cv2.VideoCapture(self._location(), self._api())
+            self._disconnected = False
+            return self._properties()
+        self._cap.release()
+        self._wait_retry()
+        self._cap = cv2.VideoCapture(self._location(), self._api())
+        self._disconnected = not self._cap.isOpened()
+        self._backoff(not self._disconnected)
+        if not self._disconnected:
+            self._properties()
+
+    def _properties(self):
+        w = int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        h = int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.width, self.height = self.scale or (w, h)
+        fps = self._cap.get(cv2.CAP_PROP_FPS)  # warning: may return 0 or nan
+        self.fps = fps if math.isfinite(fps) else 0
+        self.frames = max(int(self._cap.get(cv2.CAP_PROP_FRAME_COUNT)), 0) or float('inf')
+
+    def _location(self):
+        return self.source
+
+    def _api(self):
+        return cv2.CAP_ANY
+
+    def isOpened(self):
+        return self._cap.isOpened() or self._disconnected
+
+    def grab(self):
+        return self._cap.grab()
+
+    def retrieve(self, image: np.ndarray = None):
+        if image is not None and image.shape == (self.height, self.width, 3) and not self.scale:
+            success, frame = self._cap.retrieve(image)  # decode in place
+        else:
+            success, frame = self._cap.retrieve()
+        if not success:
+            return False, image
+        return self._output(frame, image)
+
+    def release(self):
+        self._disconnected = False
+        self._cap.release()
+
+
+class GStreamerDecoder(OpenCVDecoder):
+    # GStreamer pipeline through OpenCV, scaling (and optional key frame filtering) happen in the pipeline.
+    keyframe_only_support = True
+
+    def _properties(self):
+        self.width = int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = self._cap.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if math.isfinite(fps) else 0
+        self.frames = max(int(self._cap.get(cv2.CAP_PROP_FRAME_COUNT)), 0) or float('inf')
+
+    def _location(self):
+        source = str(self.source)
+        is_stream = source.lower().startswith('rtsp://')
+        if is_stream:
+            pipeline = f'rtspsrc location="{source}" protocols=udp latency=0 ! rtph264depay ! h264parse'
+        else:
+            pipeline = f'filesrc location="{source}" ! parsebin'
+        if self.keyframe_only:
+            pipeline += ' ! identity drop-buffer-flags=delta-unit'
+        pipeline += f' ! {GSTREAMER_DECODER} ! videoconvert ! videoscale ! video/x-raw,format=BGR'
+        if self.scale:
+            pipeline += f',width={self.scale[0]},height={self.scale[1]}'
+        # Live streams keep only the newest frame, files are read in full.
+        pipeline += ' ! appsink drop=true max-buffers=1 sync=false' if is_stream else ' ! appsink sync=false'
+        return pipeline
+
+    def _api(self):
+        return cv2.CAP_GSTREAMER
+
+    def retrieve(self, image: np.ndarray = None):
+        success, frame = self._cap.retrieve(image) if image is not None else self._cap.retrieve()
+        if not success:
+            return False, image
+        return self._output(frame, image)
+
+
+class PyAVDecoder(Decoder):
+    # FFmpeg through PyAV, with threaded decoding and scaling in the color conversion.
+    # A failed reconnect keeps the decoder open but disconnected, grab() fails until the next open() succeeds.
+    def open(self):
+        try:
+            import av
+        except ImportError as e:
+            raise ImportError('PyAV decoder requires "av", i.e. pip install av') from e
+        if not hasattr(self, '_container'):  # first open, errors are raised.
+            return self._connect(av)
+        self.release()
+        self._opened = True
+        self._wait_retry()
+        try:
+            self._connect(av)
+        except Exception:  # av.AVError or OSError, camera or network down.
+            self._backoff(False)
+            return
+        self._backoff(True)
+
+    def _connect(self, av):
+        self._container = None
+        source = str(self.source)
+        options = {'rtsp_transport': 'udp'} if source.lower().startswith('rtsp://') else {}
+        self._container = av.open(source, options=options)
+        self._stream = self._container.streams.video[0]
+        self._stream.thread_type = 'AUTO'  # frame and slice threads.
+        if self.keyframe_only:
+            self._stream.codec_context.skip_frame = 'NONKEY'
+        self._decode = self._container.decode(self._stream)
+        self._frame = None
+        self._opened = True
+        self.width, self.height = self.scale or (self._stream.codec_context.width, self._stream.codec_context.height)
+        self.fps = float(self._stream.average_rate or 0)
+        self.frames = self._stream.frames or float('inf')
+
+    def isOpened(self):
+        return self._opened
+
+    def grab(self):
+        if self._container is None:  # disconnected.
+            return False
+        try:
+            self._frame = next(self._decode)
+            return True
+        except StopIteration:
+            self._opened = False
+        except Exception:  # av.AVError, i.e. lost connection.
+            pass
+        self._frame = None
+        return False
+
+    def retrieve(self, image: np.ndarray = None):
+        if self._frame is None:
+            return False, image
+        w, h = image.shape[1::-1] if image is not None else (self.width, self.height)
+        frame = self._frame.reformat(width=w, height=h, format='bgr24').to_ndarray()
+        return self._output(frame, image)
+
+    def release(self):
+        self._opened = False
+        self._frame = None
+        if self._container is not None:
+            self._container.close()
+            self._container = None
+
+
+DECODERS = {
+    'opencv': OpenCVDecoder,
+    'gstreamer': GStreamerDecoder,
+    'pyav': PyAVDecoder,
+}
+
+
+def create_decoder(source, backend: str = DECODER, scale: tuple = DECODER_SCALE,
+                   keyframe_only: bool = DECODER_KEYFRAME_ONLY) -> Decoder:
+    if isinstance(source, int):  # webcam, OpenCV only.
+        backend = 'opencv'
+    return DECODERS[backend](source, scale=scale, keyframe_only=keyframe_only and backend != 'opencv')
+
+
+def main():
+    # Decode a local video file with a backend and report the decode rate.
+    # Usage: python -m utils.decoders video.mp4 --backend pyav --scale 960 540 --keyframe-only
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('source', type=str, help='video file or stream.')
+    parser.add_argument('--backend', type=str, default=DECODER, choices=list(DECODERS))
+    parser.add_argument('--scale', type=int, nargs=2, default=None, help='output size. (w h)')
+    parser.add_argument('--keyframe-only', action='store_true', help='decode key frames only.')
+    parser.add_argument('--frames', type=int, default=300, help='maximum frames to decode.')
+    opt = parser.parse_args()
+
+    decoder = create_decoder(opt.source, opt.backend, opt.scale, opt.keyframe_only)
+    assert decoder.isOpened(), f'Failed to open {opt.source}'
+    image = np.empty((decoder.height, decoder.width, 3), dtype=np.uint8)
+    n, t = 0, time.perf_counter()
+    while n < opt.frames:
+        success, _ = decoder.read(image)
+        if not success:
+            break
+        n += 1
+    dt = time.perf_counter() - t
+    decoder.release()
+    print(f'{opt.backend}: {n} frames {decoder.width}x{decoder.height} in {dt:.2f}s ({n / max(dt, 1E-9):.1f} FPS)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+import time
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+from config import FRAME_BUFFER_SLOTS
+
+# Header: [latest seq, latest slot, pinned slot, height, width, channels, slots, latest time (ms)]
+HEADER_SIZE = 8
+
+
+def frame_buffer_name(node: str):
+    # Shared memory name of a node's stream, so other processes can attach to it.
+    return f'alpr_{node}_frames'
+
+
+class FrameRingBuffer:
+    # Fixed-size ring of frames in shared memory.
+    # One writer fills free slots, readers pin the latest slot and read it in place.
+    def __init__(
+        self,
+        name: str = None,  # Shared memory name. (None: generated)
+        shape: tuple = None,  # Frame shape (height, width, channels), required to create.
+        slots: int = FRAME_BUFFER_SLOTS,  # Number of frames, at least 3.
+        create: bool = True,  # Create the buffer, otherwise attach to an existing one.
+    ):
+        if create:
+            assert slots >= 3, 'a frame ring buffer needs at least 3 slots.'
+            size = (HEADER_SIZE + slots) * 8 + slots * int(np.prod(shape))
+            try:
+                self._shm = shared_memory.SharedMemory(name, create=True, size=size)
+            except FileExistsError:  # left behind by a crashed process.
+                shared_memory.SharedMemory(name).unlink()
+                self._shm = shared_memory.SharedMemory(name, create=True, size=size)
+            self._header = np.ndarray((HEADER_SIZE,), np.int64, buffer=self._shm.buf)
+            self._header[:] = (0, -1, -1, *shape, slots, 0)
+        else:
+            self._shm = shared_memory.SharedMemory(name)
+            self._header = np.ndarray((HEADER_SIZE,), np.int64, buffer=self._shm.buf)
+            shape, slots = tuple(int(x) for x in self._header[3:6]), int(self._header[6])
+        self.name = self._shm.name
+        self.shape = tuple(shape)
+        self.slots = slots
+        self._seqs = np.ndarray((slots,), np.int64, buffer=self._shm.buf, offset=HEADER_SIZE * 8)
+        self._frames = np.ndarray((slots, *shape), np.uint8, buffer=self._shm.buf,
+                                  offset=(HEADER_SIZE + slots) * 8)
+        if create:
+            self._seqs[:] = 0
+        self._owner = create
+
+    @property
+    def seq(self):
+        # Sequence number of the latest frame. (0: no frame yet)
+        return int(self._header[0])
+
+    @property
+    def timestamp(self):
+        # Epoch seconds of the latest frame.
+        return int(self._header[7]) / 1E3
+
+    # > Writer functions
+    def slot(self):
+        # Reserve a slot that is neither the latest frame nor pinned by a reader.
+        # A reader pins before validating the seq, the writer invalidates before checking the pin,
+        # so a reader pinning the slot meanwhile either sees it invalid or makes the writer move on.
+        latest, index = self._header[1], self._header[1]
+        while True:
+            index = (index + 1) % self.slots
+            if index == latest or index == self._header[2]:
+                continue
+            seq = self._seqs[index]
+            self._seqs[index] = -1  # invalidate while writing.
+            if self._header[2] != index:
+                return index, self._frames[index]
+            self._seqs[index] = seq  # pinned meanwhile, leave it intact.
+
+    def publish(self, index: int):
+        seq = self.seq + 1
+        self._seqs[index] = seq
+        self._header[1] = index
+        self._header[7] = int(time.time() * 1E3)
+        self._header[0] = seq
+        return seq
+
+    def write(self, frame: np.ndarray):
+        index, view = self.slot()
+        np.copyto(view, frame)
+        return self.publish(index)
+
+    # > Reader functions
+    def latest(self, pin: bool = True):
+        # Return (seq, view) of the latest frame, zero-copy.
+        # A pinned view stays valid until the next pinned call, only one reader may pin.
+        # Unpinned readers must copy the view and check is_valid(seq) afterwards.
+        while True:
+            seq, index = self.seq, int(self._header[1])
+            if index < 0:
+                return 0, None
+            if pin:
+                self._header[2] = index
+            if self._seqs[index] == seq:  # not reclaimed by the writer meanwhile.
+                return seq, self._frames[index]
+
+    def is_valid(self, seq: int):
+        # Whether the frame with this seq is still in the buffer.
+        return bool((self._seqs == seq).any())
+
+    def snapshot(self):
+        # Return (seq, copy) of the latest frame without pinning, safe for any number of readers.
+        for _ in range(3):
+            seq, view = self.latest(pin=False)
+            if view is None:
+                return 0, None
+            frame = view.copy()
+            if self.is_valid(seq):
+                return seq, frame
+        return 0, None
+
+    def close(self):
+        # Idempotent, the writer must have stopped.
+        if self._shm is None:
+            return
+        shm, self._shm = self._shm, None
+        self._header = self._seqs = self._frames = None
+        try:
+            shm.close()
+        except BufferError:  # frames still referenced, released with them.
+            pass
+        if self._owner:
+            try:
+                shm.unlink()
+            except FileNotFoundError:  # removed by another process already.
+                pass
+        else:  # attaching registers the segment too, do not let this process remove it.
+            resource_tracker.unregister(shm._name, 'shared_memory')
@@ -0,0 +1,91 @@
+from constants.license_plate import LICENSE_NUMBER_CONFUSIONS
+
+_costs = {}
+for (a, b), cost in LICENSE_NUMBER_CONFUSIONS.items():
+    _costs[(a, b)] = _costs[(b, a)] = cost
+
+
+def plate_distance(a: str, b: str):
+    # Levenshtein distance with cheaper substitutions of similar characters.
+    # A metric, since the substitution costs satisfy the triangle inequality with indels of 1.
+    if a == b:
+        return 0.0
+    prev = [float(j) for j in range(len(b) + 1)]
+    for i, ca in enumerate(a, 1):
+        curr = [float(i)]
+        for j, cb in enumerate(b, 1):
+            sub = 0.0 if ca == cb else _costs.get((ca, cb), 1.0)
+            curr.append(min(prev[j] + 1, curr[j - 1] + 1, prev[j - 1] + sub))
+        prev = curr
+    return prev[-1]
+
+
+MIN_COST = min([1.0, *_costs.values()])
+
+
+def deletions(text: str, depth: int):
+    # text with up to depth characters deleted.
+    variants, layer = {text}, {text}
+    for _ in range(depth):
+        layer = {v[:i] + v[i + 1:] for v in layer for i in range(len(v))}
+        variants |= layer
+    return variants
+
+
+class PlateIndex:
+    # Symmetric deletion index for plates within a plate_distance.
+    # Plates within distance d differ by at most d / MIN_COST edits, so they share a deletion variant.
+    # Candidates are found by dict lookups and verified with plate_distance.
+    # Sets are replaced rather than mutated, so copies share them safely.
+    def __init__(self, items=(), max_distance: float = 1.0):
+        self.depth = int(max_distance / MIN_COST)
+        self._variants = {}  # deletion variant -> plates.
+        self._items = set()
+        for item in items:
+            self.add(item)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, item: str):
+        return item in self._items
+
+    def copy(self):
+        index = PlateIndex.__new__(PlateIndex)
+        index.depth = self.depth
+        index._variants = dict(self._variants)
+        index._items = set(self._items)
+        return index
+
+    def add(self, item: str):
+        if item in self._items:
+            return
+        self._items.add(item)
+        for variant in deletions(item, self.depth):
+            self._variants[variant] = self._variants.get(variant, frozenset()) | {item}
+
+    def discard(self, item: str):
+        if item not in self._items:
+            return
+        self._items.discard(item)
+        for variant in deletions(item, self.depth):
+            plates = self._variants.get(variant, frozenset()) - {item}
+            if len(plates) == 0:
+                self._variants.pop(variant, None)
+            else:
+                self._variants[variant] = plates
+
+    def search(self, item: str, max_distance: float):
+        # Return [(distance, item)] within max_distance, nearest first.
+        # depth + 1 edits cost at least (depth + 1) * MIN_COST.
+        assert max_distance < (self.depth + 1) * MIN_COST, 'max_distance is beyond the index depth.'
+        candidates = set()
+        for variant in deletions(item, self.depth):
+            candidates |= self._variants.get(variant, frozenset())
+        results = []
+        for candidate in candidates:
+            d = plate_distance(item, candidate)
+            if d <= max_distance:
+                results.append((d, candidate))
+        results.sort()
+        return results
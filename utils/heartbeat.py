@@ -0,0 +1,93 @@
+import atexit
+import random
+import time
+from threading import Event, Lock, Thread
+from utils.datetimefunc import datetime_now
+from utils.dbwriter import get_writer
+from utils.logger import getLogger
+from config import HEARTBEAT_INTERVAL, HEARTBEAT_JITTER
+
+
+class HeartbeatService:
+    # Writes connected_timestamp of every registered node in one batched write per beat.
+    def __init__(
+        self,
+        interval: float = HEARTBEAT_INTERVAL,  # Seconds between beats.
+        jitter: float = HEARTBEAT_JITTER,  # Random +/- seconds added to each interval.
+        writer=None,  # DbWriter. (None: the process writer)
+    ):
+        self.interval = interval
+        self.jitter = jitter
+        self._writer = writer if writer is not None else get_writer()
+        self._logger = getLogger('Heartbeat')
+        self._nodes = {}  # node path -> is_alive function.
+        self._lock = Lock()
+        self._stop_event = Event()
+        self._thread = None
+
+        # > Stats
+        self.beats = 0
+        self.missed_beats = 0  # Beats skipped because the service was late.
+        self.missed = {}  # node path -> beats skipped because the node was not alive.
+
+    def register(self, path: str, is_alive=None):
+        # Beat for a node while is_alive() returns True, starting now.
+        with self._lock:
+            self._nodes[path] = is_alive
+            self.missed.setdefault(path, 0)
+            if self._thread is None:
+                self._thread = Thread(target=self._process, daemon=True)
+                self._thread.start()
+        self._writer.set(f'{path}/connected_timestamp', datetime_now()[1], urgent=True)
+
+    def unregister(self, path: str):
+        with self._lock:
+            self._nodes.pop(path, None)
+
+    def beat(self):
+        _, timestamp = datetime_now()
+        with self._lock:
+            nodes = list(self._nodes.items())
+        for path, is_alive in nodes:
+            if is_alive is not None and not is_alive():
+                self.missed[path] += 1
+                continue
+            self._writer.set(f'{path}/connected_timestamp', timestamp)
+        self._writer.flush_soon()
+        self.beats += 1
+
+    def stats(self):
+        return {'nodes': len(self._nodes), 'beats': self.beats,
+                'missed_beats': self.missed_beats, 'missed': dict(self.missed)}
+
+    def _process(self):
+        deadline = time.monotonic()
+        while True:
+            deadline += self.interval + random.uniform(-self.jitter, self.jitter)
+            if self._stop_event.wait(max(deadline - time.monotonic(), 0)):
+                break
+            late = time.monotonic() - deadline
+            if late > self.interval:  # i.e. the process was suspended.
+                self.missed_beats += int(late // self.interval)
+                self._logger.warning(f'Heartbeat is late by {late:.1f} seconds.')
+                deadline = time.monotonic()
+            self.beat()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+_heartbeat = None
+_heartbeat_lock = Lock()
+
+
+def get_heartbeat():
+    # HeartbeatService of this process.
+    global _heartbeat
+    with _heartbeat_lock:
+        if _heartbeat is None:
+            _heartbeat = HeartbeatService()
+            atexit.register(_heartbeat.stop)
+    return _heartbeat
@@ -0,0 +1,49 @@
+import time
+import cv2
+from config import MOTION_WIDTH, MOTION_PIXEL_THRES, MOTION_THRESHOLD, MOTION_HOLD, MOTION_IDLE_INTERVAL
+
+
+class MotionGate:
+    # Cheap frame differencing on a downscaled grayscale image, in front of the detector.
+    def __init__(
+        self,
+        width: int = MOTION_WIDTH,  # Width of the downscaled image.
+        pixel_thres: int = MOTION_PIXEL_THRES,  # Gray level change of a moving pixel.
+        threshold: float = MOTION_THRESHOLD,  # Fraction of moving pixels to wake up.
+        hold: float = MOTION_HOLD,  # Seconds to stay awake after the last motion.
+        idle_interval: float = MOTION_IDLE_INTERVAL,  # Seconds between detector frames when idle.
+    ):
+        self.width = width
+        self.pixel_thres = pixel_thres
+        self.threshold = threshold
+        self.hold = hold
+        self.idle_interval = idle_interval
+        self._prev = None
+        self._active_until = 0
+        self._next_idle = 0
+
+    def is_active(self):
+        return time.monotonic() < self._active_until
+
+    def update(self, im, wake: bool = False):
+        # Returns whether the detector should run on this frame.
+        h = max(1, im.shape[0] * self.width // im.shape[1])
+        gray = cv2.cvtColor(cv2.resize(im, (self.width, h), interpolation=cv2.INTER_AREA),
+                            cv2.COLOR_BGR2GRAY)
+        gray = cv2.GaussianBlur(gray, (5, 5), 0)
+        if self._prev is None or self._prev.shape != gray.shape:
+            moving = True
+        else:
+            _, mask = cv2.threshold(cv2.absdiff(gray, self._prev), self.pixel_thres, 255, cv2.THRESH_BINARY)
+            moving = cv2.countNonZero(mask) > self.threshold * mask.size
+        self._prev = gray
+
+        now = time.monotonic()
+        if moving or wake:
+            self._active_until = now + self.hold
+        if now < self._active_until:
+            return True
+        if now >= self._next_idle:  # low duty cycle check while the lane is static.
+            self._next_idle = now + self.idle_interval
+            return True
+        return False
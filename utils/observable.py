@@ -0,0 +1,149 @@
+from threading import Lock
+
+_MISSING = object()
+
+
+def _normalize(value):
+    # Plain copy of a value as stored by Realtime Database, which drops empty containers.
+    if isinstance(value, (dict, list, tuple)) and len(value) == 0:
+        return None
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+class ChangeSet:
+    # Dirty database paths ("group/key") of an object, with the values last written to them.
+    def __init__(self):
+        self.version = 0  # Bumped on every change.
+        self._dirty = set()
+        self._written = {}  # path -> last written value.
+        self._lock = Lock()
+
+    def mark(self, *paths: str):
+        with self._lock:
+            self._dirty.update(paths)
+            self.version += 1
+
+    def is_dirty(self):
+        return len(self._dirty) != 0
+
+    def written(self, group: str, values: dict):
+        # Record a full write of a group, i.e. reference.set(values).
+        with self._lock:
+            prefix = group + '/'
+            for path in [p for p in self._written if p.startswith(prefix)]:
+                del self._written[path]
+            self._dirty = {p for p in self._dirty if not p.startswith(prefix)}
+            for key, value in values.items():
+                self._written[prefix + key] = _normalize(value)
+
+    def collect(self, **groups):
+        # Return a multi-path update of the dirty paths whose value changed since the last write.
+        # groups: group name -> function returning the group's current values.
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        values, update = {}, {}
+        for path in dirty:
+            group, key = path.split('/', 1)
+            if group not in values:
+                values[group] = groups[group]()
+            value = _normalize(values[group].get(key))
+            if self._written.get(path, _MISSING) != value:
+                update[path] = value
+        with self._lock:
+            self._written.update(update)
+        return update
+
+    def reconcile(self, group: str, event, local: dict):
+        # Mark the keys of a database event that differ from the local values, i.e. edited remotely.
+        keys = [k for k in event.path.split('/') if k]
+        if len(keys) == 0:
+            remote = event.data if isinstance(event.data, dict) else {}
+            if event.event_type == 'patch':
+                changed = remote.keys()
+            else:  # put replaces the whole group.
+                changed = set(local) | set(remote)
+        else:
+            remote = {keys[0]: event.data} if len(keys) == 1 else {}
+            changed = keys[:1]
+        stale = [k for k in changed if k not in remote or _normalize(remote[k]) != _normalize(local.get(k))]
+        if stale:
+            with self._lock:
+                for key in stale:
+                    self._written.pop(f'{group}/{key}', None)
+            self.mark(*(f'{group}/{key}' for key in stale))
+        return stale
+
+
+class TrackedDict(dict):
+    # Dict calling on_change after every mutation, nested values are not tracked.
+    def __init__(self, values=(), on_change=None):
+        super().__init__(values)
+        self._on_change = on_change
+
+    def _changed(self):
+        if self._on_change is not None:
+            self._on_change()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._changed()
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._changed()
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+    def pop(self, *args):
+        value = super().pop(*args)
+        self._changed()
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self._changed()
+        return item
+
+    def setdefault(self, key, default=None):
+        value = super().setdefault(key, default)
+        self._changed()
+        return value
+
+
+class Tracked:
+    # Attribute marking database paths of its owner's ChangeSet (self._changes) dirty when assigned.
+    # Dicts are wrapped in a TrackedDict, so in-place mutations mark the paths too.
+    def __init__(self, *paths: str):
+        self.paths = paths
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        try:
+            return obj.__dict__[self.name]
+        except KeyError:
+            raise AttributeError(self.name) from None
+
+    def __set__(self, obj, value):
+        changes = obj._changes
+        if isinstance(value, dict):
+            value = TrackedDict(value, lambda: changes.mark(*self.paths))
+            old = _MISSING
+        else:
+            old = obj.__dict__.get(self.name, _MISSING)
+        obj.__dict__[self.name] = value
+        if old is _MISSING or old != value:
+            changes.mark(*self.paths)
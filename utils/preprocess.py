@@ -0,0 +1,119 @@
+import time
+import cv2
+import numpy as np
+import torch
+
+
+class Preprocessor:
+    # Letterbox, BGR to RGB, HWC to CHW and normalization in one pass per frame,
+    # written straight into a reused (pinned on CUDA) input tensor.
+    def __init__(
+        self,
+        img_size=(640, 640),  # Inference size. (height, width)
+        stride: int = 32,
+        auto: bool = True,  # Minimum rectangle padding.
+        device: torch.device = torch.device('cpu'),
+        half: bool = False,  # FP16 input.
+        color: tuple = (114, 114, 114),  # Padding color.
+    ):
+        self.img_size = (img_size, img_size) if isinstance(img_size, int) else tuple(img_size)
+        self.stride = stride
+        self.auto = auto
+        self.device = device
+        self.half = half
+        self.color = color
+
+        self.ratio_pads = []  # ((gain, gain), (pad w, pad h)) per frame, for scale_boxes.
+        self.dt = 0.0  # Total seconds spent.
+        self._shapes = None  # Frame shapes the buffers were built for.
+        self._layouts = []  # (new unpad (w, h), top, left) per frame.
+        self._canvases = []  # Padded uint8 image per frame.
+        self._host = None  # Reused host tensor.
+        self._tensor = None  # Reused device tensor.
+
+    def _letterbox_layout(self, shape):
+        # Same geometry as utils.augmentations.letterbox.
+        r = min(self.img_size[0] / shape[0], self.img_size[1] / shape[1])
+        new_unpad = int(round(shape[1] * r)), int(round(shape[0] * r))
+        dw, dh = self.img_size[1] - new_unpad[0], self.img_size[0] - new_unpad[1]
+        if self.auto:
+            dw, dh = np.mod(dw, self.stride), np.mod(dh, self.stride)
+        dw, dh = dw / 2, dh / 2
+        top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+        left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+        out_shape = (new_unpad[1] + top + bottom, new_unpad[0] + left + right)
+        return (new_unpad, top, left), ((r, r), (dw, dh)), out_shape
+
+    def _build(self, frames):
+        self._shapes = [x.shape for x in frames]
+        self._layouts, self.ratio_pads, out_shapes = [], [], []
+        for shape in self._shapes:
+            layout, ratio_pad, out_shape = self._letterbox_layout(shape)
+            self._layouts.append(layout)
+            self.ratio_pads.append(ratio_pad)
+            out_shapes.append(out_shape)
+        assert len(set(out_shapes)) == 1, 'frames must letterbox to the same shape.'
+        h, w = out_shapes[0]
+        self._canvases = [np.full((h, w, 3), self.color, dtype=np.uint8) for _ in frames]
+        dtype = torch.float16 if self.half else torch.float32
+        self._host = torch.empty((len(frames), 3, h, w), dtype=dtype)
+        if self.device.type != 'cpu':
+            self._host = self._host.pin_memory()
+            self._tensor = torch.empty_like(self._host, device=self.device)
+        else:
+            self._tensor = self._host
+
+    def __call__(self, frames: list):
+        # frames: BGR uint8 images -> normalized RGB BCHW tensor on device.
+        t = time.perf_counter()
+        if self._shapes != [x.shape for x in frames]:
+            self._build(frames)
+        host = self._host.numpy()
+        for i, (frame, canvas, (new_unpad, top, left)) in enumerate(zip(frames, self._canvases, self._layouts)):
+            region = canvas[top:top + new_unpad[1], left:left + new_unpad[0]]
+            if frame.shape[1::-1] != new_unpad:
+                cv2.resize(frame, new_unpad, dst=region, interpolation=cv2.INTER_LINEAR)
+            else:
+                np.copyto(region, frame)
+            # BGR to RGB, HWC to CHW, uint8 to float and 0-255 to 0.0-1.0 in one ufunc pass.
+            np.multiply(canvas.transpose(2, 0, 1)[::-1], 1 / 255, out=host[i], casting='unsafe')
+        if self._tensor is not self._host:
+            self._tensor.copy_(self._host, non_blocking=True)
+        self.dt += time.perf_counter() - t
+        return self._tensor
+
+
+def main():
+    # Micro-benchmark against the LoadStreams + inference preprocessing path.
+    # Usage: python -m utils.preprocess --size 1080 1920 --batch 2
+    import argparse
+    from utils.augmentations import letterbox
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, nargs=2, default=[1080, 1920], help='frame size. (h w)')
+    parser.add_argument('--imgsz', type=int, default=640, help='inference size.')
+    parser.add_argument('--batch', type=int, default=2, help='frames per batch.')
+    parser.add_argument('--runs', type=int, default=100, help='number of batches.')
+    opt = parser.parse_args()
+
+    frames = [np.random.randint(0, 255, (*opt.size, 3), dtype=np.uint8) for _ in range(opt.batch)]
+
+    def current():
+        img = np.stack([letterbox(x, opt.imgsz, stride=32, auto=True)[0] for x in frames], 0)
+        img = np.ascontiguousarray(img[..., ::-1].transpose((0, 3, 1, 2)))
+        im = torch.from_numpy(img).float()
+        im /= 255
+        return im
+
+    preprocess = Preprocessor(opt.imgsz, stride=32, auto=True)
+    assert torch.allclose(current(), preprocess(frames), atol=1e-6), 'outputs differ.'
+
+    for name, fn in (('current', current), ('fused', lambda: preprocess(frames))):
+        t = time.perf_counter()
+        for _ in range(opt.runs):
+            fn()
+        print(f'{name}: {(time.perf_counter() - t) / opt.runs * 1E3:.2f}ms per batch of {opt.batch}')
+
+
+if __name__ == '__main__':
+    main()
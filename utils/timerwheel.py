@@ -0,0 +1,92 @@
+import time
+from threading import Lock
+from config import TIMER_TICK, TIMER_SLOTS
+
+
+class Timer:
+    # Handle of a scheduled callback.
+    __slots__ = ('deadline', 'tick', 'callback', 'fired', 'cancelled')
+
+    def __init__(self, deadline: float, tick: int, callback):
+        self.deadline = deadline  # Monotonic seconds.
+        self.tick = tick  # Absolute wheel tick of the deadline.
+        self.callback = callback
+        self.fired = False
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+    # Hashed timing wheel on the monotonic clock.
+    # schedule() and cancel() are O(1), advance() only visits the slots of the elapsed ticks.
+    # Timers keep their exact deadline, the tick only selects the slot.
+    def __init__(
+        self,
+        tick: float = TIMER_TICK,  # Seconds per slot.
+        slots: int = TIMER_SLOTS,  # Slots per revolution.
+        clock=time.monotonic,
+    ):
+        self.tick = tick
+        self.slots = slots
+        self._clock = clock
+        self._wheel = [[] for _ in range(slots)]
+        self._cursor = int(clock() / tick)  # Absolute tick of the last advance.
+        self._lock = Lock()
+
+    def schedule_at(self, deadline: float, callback) -> Timer:
+        # Fire callback() once the monotonic clock reaches deadline.
+        with self._lock:
+            tick = max(int(deadline / self.tick), self._cursor)
+            timer = Timer(deadline, tick, callback)
+            self._wheel[tick % self.slots].append(timer)
+        return timer
+
+    def schedule(self, delay: float, callback) -> Timer:
+        return self.schedule_at(self._clock() + delay, callback)
+
+    def _elapsed_ticks(self, target: int):
+        # Absolute ticks from the cursor to target, at most one revolution.
+        return range(max(self._cursor, target - self.slots + 1), target + 1)
+
+    def advance(self, now: float = None):
+        # Fire the expired timers, returns the number fired.
+        now = self._clock() if now is None else now
+        target = int(now / self.tick)
+        expired = []
+        with self._lock:
+            for tick in self._elapsed_ticks(target):
+                slot = self._wheel[tick % self.slots]
+                if not slot:
+                    continue
+                pending = []
+                for timer in slot:
+                    if timer.cancelled:
+                        continue
+                    if timer.tick <= target and timer.deadline <= now:
+                        expired.append(timer)
+                    else:  # later revolution or later in the current tick.
+                        pending.append(timer)
+                slot[:] = pending
+            self._cursor = max(self._cursor, target)
+        for timer in expired:
+            timer.fired = True
+            timer.callback()
+        return len(expired)
+
+    def next_timeout(self, default: float):
+        # Seconds until the next deadline, at most default.
+        now = self._clock()
+        horizon = int((now + default) / self.tick)
+        with self._lock:
+            for tick in range(self._cursor, min(horizon, self._cursor + self.slots - 1) + 1):
+                deadlines = [t.deadline for t in self._wheel[tick % self.slots]
+                             if t.tick == tick and not t.cancelled]
+                if deadlines:
+                    return min(max(min(deadlines) - now, 0), default)
+        return default
+
+    def __len__(self):
+        with self._lock:
+            return sum(not t.cancelled for slot in self._wheel for t in slot)
@@ -0,0 +1,128 @@
+import time
+from threading import Lock
+import cv2
+import numpy as np
+from config import TRACK_IOU, TRACK_MAX_AGE, OCR_MOVE_IOU, OCR_HASH_DISTANCE, OCR_MIN_CONF, OCR_RETRY_DELAY
+
+
+def box_iou(a, b):
+    # IoU of two xyxy boxes.
+    w = min(a[2], b[2]) - max(a[0], b[0])
+    h = min(a[3], b[3]) - max(a[1], b[1])
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / ((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter)
+
+
+def dhash(im, size=8):
+    # Difference hash of a grayscale image, as a (size * size) bits integer.
+    small = cv2.resize(im, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = np.packbits(small[:, 1:] > small[:, :-1])
+    return int.from_bytes(bits.tobytes(), 'big')
+
+
+def hamming(a: int, b: int):
+    return bin(a ^ b).count('1')
+
+
+class Track:
+    def __init__(self, id: int, box: list, conf: float):
+        self.id = id
+        self.box = box  # Last detected box. (xyxy)
+        self.conf = conf  # Last detection confidence.
+        self.age = 0  # Frames since last detection.
+
+        # > OCR cache
+        self.license_number = None  # None: never OCR'd.
+        self.ocr_box = None
+        self.ocr_hash = None
+        self.pending = False  # OCR job in flight.
+        self.retry_at = 0.0  # No re-OCR before this monotonic time, after a failed read.
+
+
+class PlateTracker:
+    # Greedy IoU tracker with centroid fallback over NMS output of one stream.
+    def __init__(self, iou_thres: float = TRACK_IOU, max_age: int = TRACK_MAX_AGE):
+        self.iou_thres = iou_thres
+        self.max_age = max_age
+        self.tracks = []
+        self._next_id = 0
+        self._lock = Lock()  # OCR results arrive from worker threads.
+
+        # > Statistics
+        self.ocr_runs = 0
+        self.ocr_hits = 0
+
+    def update(self, dets: list):
+        # dets: [[x1, y1, x2, y2, conf], ...] -> matched track per detection.
+        matches = [None] * len(dets)
+        free = list(self.tracks)
+        pairs = sorted(((box_iou(track.box, det), i, track) for i, det in enumerate(dets)
+                        for track in free), key=lambda x: x[0], reverse=True)
+        for iou, i, track in pairs:
+            if iou < self.iou_thres:
+                break
+            if matches[i] is None and track in free:
+                matches[i] = track
+                free.remove(track)
+
+        # Centroid fallback for fast moving plates.
+        for i, det in enumerate(dets):
+            if matches[i] is not None:
+                continue
+            cx, cy = (det[0] + det[2]) / 2, (det[1] + det[3]) / 2
+            limit = max(det[2] - det[0], det[3] - det[1])
+            nearest, distance = None, limit
+            for track in free:
+                tx, ty = (track.box[0] + track.box[2]) / 2, (track.box[1] + track.box[3]) / 2
+                d = ((cx - tx) ** 2 + (cy - ty) ** 2) ** 0.5
+                if d < distance:
+                    nearest, distance = track, d
+            if nearest is not None:
+                matches[i] = nearest
+                free.remove(nearest)
+
+        # Update matched tracks and create new ones.
+        for i, det in enumerate(dets):
+            track = matches[i]
+            if track is None:
+                track = Track(self._next_id, det[:4], det[4])
+                self._next_id += 1
+                self.tracks.append(track)
+                matches[i] = track
+            track.box, track.conf, track.age = det[:4], det[4], 0
+
+        # Age out unmatched tracks.
+        for track in free:
+            track.age += 1
+        self.tracks = [track for track in self.tracks if track.age <= self.max_age]
+        return matches
+
+    def needs_ocr(self, track: Track, crop_hash: int):
+        # Re-OCR only when the cached result may no longer be valid.
+        with self._lock:
+            if track.pending or time.monotonic() < track.retry_at:
+                return False
+            need = track.license_number is None \
+                or track.conf < OCR_MIN_CONF \
+                or box_iou(track.box, track.ocr_box) < OCR_MOVE_IOU \
+                or hamming(crop_hash, track.ocr_hash) > OCR_HASH_DISTANCE
+            if need:
+                self.ocr_runs += 1
+                track.pending = True
+            else:
+                self.ocr_hits += 1
+            return need
+
+    def cache(self, track: Track, license_number: str, crop_hash: int):
+        with self._lock:
+            track.pending = False
+            if license_number is None:  # OCR job dropped, keep the old result.
+                return
+            if license_number == '':  # failed read, keep the old result and retry shortly.
+                track.retry_at = time.monotonic() + OCR_RETRY_DELAY
+                return
+            track.license_number = license_number
+            track.ocr_box = track.box
+            track.ocr_hash = crop_hash